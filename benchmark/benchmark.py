@@ -27,7 +27,7 @@ def benchmark_dumps_byline(module, lines):
 
 
 def import_modules():
-    for name in ['json', 'simplejson', 'ujson', 'rapidjson']:
+    for name in ['json', 'simplejson', 'ujson', 'rapidjson', 'orjson']:
         try:
             yield importlib.import_module(name)
         except ImportError:
@@ -0,0 +1,83 @@
+import json
+import os
+import sys
+import timeit
+from collections import OrderedDict
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "../rplugin/python3/deoplete/sources/deoplete_go",
+    ),
+)
+from go_candidates import CandidateBuilder
+
+
+NUMBER = 20
+
+SORT_CLASS = ["package", "func", "type", "var", "const"]
+
+
+def legacy_build(result, context, sort_class, package_dot=False, pointer=False):
+    # candidate loop of Source.gather_candidates before CandidateBuilder
+    if sort_class:
+        class_dict = OrderedDict((x, []) for x in sort_class)
+
+    out = []
+    sep = " "
+
+    for complete in result:
+        word = complete["name"]
+        info = complete["type"]
+        _class = complete["class"]
+        abbr = str(word + sep + info).replace(" func", "", 1)
+        kind = _class
+
+        if _class == "package" and package_dot:
+            word += "."
+        if pointer and str(context["input"][context["complete_position"] :]) == "*":
+            word = "*" + word
+
+        candidates = dict(word=word, abbr=abbr, kind=kind, info=info, dup=1)
+
+        if not sort_class or _class == "import":
+            out.append(candidates)
+        elif _class in class_dict.keys():
+            class_dict[_class].append(candidates)
+
+    if sort_class:
+        for v in class_dict.values():
+            out += v
+
+    return out
+
+
+def run_benchmarks():
+    # filesize: 1768818 byte
+    with open("json/gocode-twice.json") as f:
+        result = json.load(f)[1]
+    # CandidateBuilder takes the tuples of go_decoder.StreamDecoder
+    decoded = [(x["name"], x["type"], x["class"]) for x in result]
+    context = {"input": "\tbytes.", "complete_position": 7}
+
+    print("{} candidates, {} runs".format(len(result), NUMBER))
+    print("-" * 20)
+    for sort_class in [[], SORT_CLASS]:
+        builder = CandidateBuilder(sort_class=sort_class)
+        limited = CandidateBuilder(sort_class=sort_class, max_candidates=100)
+        assert builder.build(decoded, context) == legacy_build(result, context, sort_class)
+
+        suite = "sort_class" if sort_class else "gocode order"
+        legacy = timeit.timeit(
+            lambda: legacy_build(result, context, sort_class), number=NUMBER
+        )
+        built = timeit.timeit(lambda: builder.build(decoded, context), number=NUMBER)
+        top = timeit.timeit(lambda: limited.build(decoded, context), number=NUMBER)
+        print("{:28} {:.5f} s".format("legacy (" + suite + ")", legacy))
+        print("{:28} {:.5f} s".format("builder (" + suite + ")", built))
+        print("{:28} {:.5f} s".format("builder top 100 (" + suite + ")", top))
+
+
+if __name__ == "__main__":
+    run_benchmarks()
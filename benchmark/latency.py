@@ -0,0 +1,335 @@
+"""End-to-end completion latency of the deoplete-go source.
+
+Drives Source.gather_candidates and Source.get_complete_result against a
+stub vim object and a fake gocode executable that replays a
+benchmark/json fixture, and reports the latency percentiles, allocations
+and throughput of each stage.
+
+    python3 latency.py --fixture gocode.json --delay 5 --output after.json
+    python3 latency.py --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import stat
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCES_DIR = os.path.join(BENCHMARK_DIR, "../rplugin/python3/deoplete/sources")
+
+FAKE_GOCODE = """#!{python}
+import os
+import sys
+import time
+
+sys.stdin.buffer.read()
+time.sleep(float(os.environ["FAKE_GOCODE_DELAY"]))
+with open(os.environ["FAKE_GOCODE_FIXTURE"], "rb") as f:
+    sys.stdout.buffer.write(f.read())
+"""
+
+
+def load_deoplete():
+    """Import deoplete, or install a minimal stand-in when it is missing."""
+    try:
+        import deoplete.base.source  # noqa: F401
+        import deoplete.util  # noqa: F401
+        return "deoplete"
+    except ImportError:
+        pass
+
+    class Base(object):
+        def __init__(self, vim):
+            self.vim = vim
+            self.debug_enabled = False
+
+        def print_error(self, msg):
+            print("error: " + str(msg), file=sys.stderr)
+
+        def info(self, *args):
+            pass
+
+    def charpos2bytepos(encoding, input, pos):
+        return len(bytes(input[:pos], encoding, errors="replace"))
+
+    def getlines(vim, start=1, end="$"):
+        return vim.call("getline", start, end)
+
+    def load_external_module(base, module):
+        current = os.path.dirname(os.path.abspath(base))
+        sys.path.insert(0, os.path.join(os.path.dirname(current), module))
+
+    util = types.ModuleType("deoplete.util")
+    util.charpos2bytepos = charpos2bytepos
+    util.expand = lambda path: os.path.expandvars(os.path.expanduser(path))
+    util.getlines = getlines
+    util.load_external_module = load_external_module
+    source = types.ModuleType("deoplete.base.source")
+    source.Base = Base
+
+    sys.modules["deoplete"] = types.ModuleType("deoplete")
+    sys.modules["deoplete.base"] = types.ModuleType("deoplete.base")
+    sys.modules["deoplete.base.source"] = source
+    sys.modules["deoplete.util"] = util
+    return "stub"
+
+
+class Buffer(object):
+    def __init__(self, lines, name):
+        self.lines = lines
+        self.name = name
+        self.number = 1
+        self.options = {"fileformat": "unix"}
+
+
+class Window(object):
+    cursor = (1, 0)
+
+
+class Current(object):
+    pass
+
+
+class Vim(object):
+    """The part of the neovim API used by the source."""
+
+    def __init__(self, lines, name):
+        self.current = Current()
+        self.current.buffer = Buffer(lines, name)
+        self.current.window = Window()
+
+    def call(self, fn, *args):
+        if fn == "getline":
+            return list(self.current.buffer.lines)
+        if fn == "tempname":
+            return os.path.join(tempfile.gettempdir(), "deoplete-go-benchmark.go")
+        raise KeyError(fn)
+
+    def eval(self, expr):
+        if expr == "$GOPATH":
+            return os.environ.get("GOPATH", "")
+        raise KeyError(expr)
+
+
+def make_buffer(nlines):
+    lines = ["package main", "", "import (", '\t"bytes"', ")", ""]
+    while len(lines) < nlines - 3:
+        n = len(lines)
+        lines += ["func f%d(b []byte) int {" % n, "\treturn len(b) + %d" % n, "}"]
+    lines += ["func main() {", "\tbytes.", "}"]
+    return lines
+
+
+def make_gocode(directory):
+    path = os.path.join(directory, "gocode")
+    with open(path, "w") as f:
+        f.write(FAKE_GOCODE.format(python=sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    k = (len(samples) - 1) * p / 100.0
+    f = int(k)
+    c = min(f + 1, len(samples) - 1)
+    return samples[f] + (samples[c] - samples[f]) * (k - f)
+
+
+def measure(func, iterations, setup=None):
+    """Return the latency and allocation stats of func."""
+    samples = []
+    for i in range(iterations):
+        if setup:
+            setup(i)
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    # allocations are measured in a separate run, tracemalloc is slow
+    runs = max(1, min(iterations, 10))
+    tracemalloc.start()
+    allocated = peak = 0
+    for i in range(runs):
+        if setup:
+            setup(i)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        current, top = tracemalloc.get_traced_memory()
+        allocated += max(current - before, 0)
+        peak = max(peak, top - before)
+    tracemalloc.stop()
+
+    total = sum(samples)
+    return {
+        "iterations": iterations,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "mean_ms": total / iterations * 1000,
+        "throughput_per_s": iterations / total if total else 0.0,
+        "retained_bytes": allocated // runs,
+        "peak_bytes": peak,
+    }
+
+
+def run(args):
+    backend = load_deoplete()
+    sys.path.insert(0, SOURCES_DIR)
+    import deoplete_go
+    from go_buffer import BufferSnapshot
+    from go_candidates import CandidateBuilder
+    from go_client import Request
+    from go_decoder import decode
+
+    fixture = os.path.join(BENCHMARK_DIR, "json", args.fixture)
+    with open(fixture, "rb") as f:
+        payload = f.read()
+
+    directory = tempfile.mkdtemp(prefix="deoplete-go-benchmark")
+    os.environ["FAKE_GOCODE_FIXTURE"] = fixture
+    os.environ["FAKE_GOCODE_DELAY"] = str(args.delay / 1000.0)
+
+    lines = make_buffer(args.lines)
+    vim = Vim(lines, os.path.join(directory, "main.go"))
+    line = len(lines) - 1
+    vim.current.window.cursor = (line, 7)
+    context = {
+        "vars": {"deoplete#sources#go#gocode_binary": make_gocode(directory)},
+        "input": "\tbytes.",
+        "complete_position": 7,
+        "bufnr": 1,
+        "changedtick": 1,
+        "position": [1, line, 8, 0],
+    }
+    source = deoplete_go.Source(vim)
+    source.on_init(context)
+
+    def typing(i):
+        # a keystroke on the cursor line
+        context["changedtick"] += 1
+        lines[line - 1] = "\tbytes." + "x" * (i % 2)
+
+    def cold(i):
+        typing(i)
+        source.result_cache.entries.clear()
+
+    snapshot = BufferSnapshot()
+    snapshot.update(vim, context, line)
+    decoded = decode(payload).result[1]
+    builder = CandidateBuilder()
+
+    stages = {}
+    stages["buffer"] = measure(
+        lambda: snapshot.update(vim, context, line), args.iterations, typing
+    )
+    stages["spawn"] = measure(
+        lambda: Request(
+            [context["vars"]["deoplete#sources#go#gocode_binary"]],
+            dict(os.environ),
+            snapshot.data,
+        ).run(),
+        args.iterations,
+    )
+    stages["decode"] = measure(lambda: decode(payload), args.iterations)
+    stages["build"] = measure(lambda: builder.build(decoded, context), args.iterations)
+    stages["get_complete_result"] = measure(
+        lambda: source.get_complete_result(
+            context, source.snapshot.update(vim, context, line), vim.current.buffer.name
+        ),
+        args.iterations,
+        typing,
+    )
+    stages["gather_candidates"] = measure(
+        lambda: source.gather_candidates(context), args.iterations, cold
+    )
+    stages["gather_candidates (cached)"] = measure(
+        lambda: source.gather_candidates(context), args.iterations, typing
+    )
+
+    return {
+        "fixture": args.fixture,
+        "fixture_bytes": len(payload),
+        "candidates": len(decoded),
+        "lines": len(lines),
+        "delay_ms": args.delay,
+        "deoplete": backend,
+        "python": sys.version.split()[0],
+        "stages": stages,
+    }
+
+
+def print_results(results):
+    print(
+        "{} ({} bytes, {} candidates), {} lines, {} ms gocode delay".format(
+            results["fixture"],
+            results["fixture_bytes"],
+            results["candidates"],
+            results["lines"],
+            results["delay_ms"],
+        )
+    )
+    print("-" * 98)
+    print(
+        "{:28} {:>9} {:>9} {:>9} {:>11} {:>12} {:>12}".format(
+            "stage", "p50 ms", "p95 ms", "p99 ms", "ops/s", "retained B", "peak B"
+        )
+    )
+    for name, s in results["stages"].items():
+        print(
+            "{:28} {:9.3f} {:9.3f} {:9.3f} {:11.1f} {:12d} {:12d}".format(
+                name,
+                s["p50_ms"],
+                s["p95_ms"],
+                s["p99_ms"],
+                s["throughput_per_s"],
+                s["retained_bytes"],
+                s["peak_bytes"],
+            )
+        )
+
+
+def compare(before, after):
+    with open(before) as f:
+        old = json.load(f)["stages"]
+    with open(after) as f:
+        new = json.load(f)["stages"]
+
+    print("{:28} {:>12} {:>12} {:>9}".format("stage", "old p50 ms", "new p50 ms", "change"))
+    for name in new:
+        if name not in old:
+            continue
+        a, b = old[name]["p50_ms"], new[name]["p50_ms"]
+        change = (b - a) / a * 100 if a else 0.0
+        print("{:28} {:12.3f} {:12.3f} {:+8.1f}%".format(name, a, b, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixture", default="gocode.json")
+    parser.add_argument("--delay", type=float, default=0, help="gocode delay in ms")
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", help="write the results as json")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(args)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Memory of the cached cgo candidates, as dicts and as Candidate records.
+
+    python3 memory.py --candidates 30000 --preambles 4
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "../rplugin/python3/deoplete/sources/deoplete_go",
+    ),
+)
+from go_candidates import Candidate
+from clang_index import Clang_Index
+
+
+BUILTINS = [
+    ("CString", "CString(string) *C.char", "function"),
+    ("CBytes", "CBytes([]byte) unsafe.Pointer", "function"),
+    ("GoString", "GoString(*C.char) string", "function"),
+    ("GoStringN", "GoStringN(*C.char, C.int) string", "function"),
+    ("GoBytes", "GoBytes(unsafe.Pointer, C.int) []byte", "function"),
+]
+
+
+def make_rows(count):
+    # (word, abbr, kind) as extracted from libclang, kind as in cgo.parse_candidates
+    kinds = sorted(set(Clang_Index.kinds.values()))
+    rows = []
+    for i in range(count):
+        word = "git_function_%d" % i
+        abbr = word + "(int flags, const char *path) int"
+        rows.append((word, abbr, kinds[i % len(kinds)]))
+    return rows
+
+
+def legacy(rows):
+    # cgo.complete before Candidate: five fresh builtin dicts per preamble
+    out = [
+        {"word": w, "abbr": a, "info": a, "kind": k, "dup": 1} for w, a, k in BUILTINS
+    ]
+    out += [{"dup": 1, "word": w, "abbr": a, "info": a, "kind": k} for w, a, k in rows]
+    return out
+
+
+builtins = tuple(Candidate(*x) for x in BUILTINS)
+
+
+def records(rows):
+    out = list(builtins)
+    out += [Candidate(w, a, k) for w, a, k in rows]
+    return out
+
+
+def measure(func, rows, preambles):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cache = [func(rows) for _ in range(preambles)]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del cache
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--candidates", type=int, default=30000)
+    parser.add_argument("--preambles", type=int, default=4)
+    args = parser.parse_args()
+
+    # the strings themselves are shared by both representations
+    rows = make_rows(args.candidates)
+    print("{} candidates, {} preambles".format(args.candidates, args.preambles))
+    print("-" * 20)
+    old = measure(legacy, rows, args.preambles)
+    new = measure(records, rows, args.preambles)
+    print("{:10} {:12.2f} MB".format("dict", old / 1e6))
+    print(
+        "{:10} {:12.2f} MB ({:.0f}%)".format("Candidate", new / 1e6, new * 100.0 / old)
+    )
+
+
+if __name__ == "__main__":
+    main()
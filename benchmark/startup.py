@@ -0,0 +1,117 @@
+"""Startup time of the deoplete-go source.
+
+Imports deoplete_go and runs Source.on_init in a fresh interpreter per
+sample, with cgo (and its prewarming) and the stdlib cache enabled, and
+reports the time of both and the optional modules they loaded.
+
+    python3 startup.py --samples 20 --libclang-path /usr/lib/libclang.so
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# loaded on first use: cgo completion, stdlib lookup and json decoding
+LAZY_MODULES = (
+    "cgo",
+    "clang.cindex",
+    "clang_index",
+    "concurrent.futures",
+    "go_pkgconfig",
+    "orjson",
+    "rapidjson",
+    "simplejson",
+    "stdlib",
+    "ujson",
+)
+
+
+def child(libclang_path):
+    sys.path.insert(0, BENCHMARK_DIR)
+    from latency import SOURCES_DIR, Vim, load_deoplete, make_buffer
+
+    load_deoplete()
+    sys.path.insert(0, SOURCES_DIR)
+    before = set(sys.modules)
+
+    start = time.perf_counter()
+    import deoplete_go
+
+    imported = time.perf_counter()
+    context = {
+        "vars": {
+            "deoplete#sources#go#cgo": 1,
+            "deoplete#sources#go#cgo#libclang_path": libclang_path,
+            "deoplete#sources#go#cgo#prewarm": 1,
+            "deoplete#sources#go#use_cache": 1,
+        },
+    }
+    error = None
+    try:
+        deoplete_go.Source(Vim(make_buffer(100), "main.go")).on_init(context)
+    except Exception as e:
+        # e.g. an eager import of the missing libclang-python3 submodule
+        error = "{}: {}".format(type(e).__name__, e)
+    end = time.perf_counter()
+
+    loaded = set(sys.modules) - before
+    print(
+        json.dumps(
+            {
+                "import_ms": (imported - start) * 1000,
+                "init_ms": (end - imported) * 1000,
+                "modules": len(loaded),
+                "lazy": [x for x in LAZY_MODULES if x in loaded],
+                "error": error,
+            }
+        )
+    )
+
+
+def median(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    return (samples[(n - 1) // 2] + samples[n // 2]) / 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--libclang-path", default="libclang.so")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.libclang_path)
+        return
+
+    results = []
+    for _ in range(args.samples):
+        out = subprocess.check_output(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--child",
+                "--libclang-path",
+                args.libclang_path,
+            ]
+        )
+        results.append(json.loads(out))
+
+    last = results[-1]
+    print("{} samples, median".format(args.samples))
+    print("-" * 20)
+    print("import   {:8.2f} ms".format(median([x["import_ms"] for x in results])))
+    print("on_init  {:8.2f} ms".format(median([x["init_ms"] for x in results])))
+    print("modules  {:8d}".format(last["modules"]))
+    print("lazy     {}".format(", ".join(last["lazy"]) or "-"))
+    if last["error"]:
+        print("error    {}".format(last["error"]))
+
+
+if __name__ == "__main__":
+    main()
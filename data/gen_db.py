@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Pack the stdlib json into one indexed <GOOS>_<GOARCH>.db per platform.
+
+The database is mapped by the stdlib cache (g:deoplete#sources#go#use_cache),
+which then decodes only the package being completed.
+
+    ./gen_db.py linux_amd64 darwin_amd64
+    ./gen_db.py --from-json json/1.7.3/linux_amd64 -o linux_amd64.db
+
+Without --from-json, json/<version>/<GOOS>_<GOARCH>.json written by
+gen_json.py is converted, or the json/<version>/<GOOS>_<GOARCH> directory of
+the older one-file-per-package layout.
+"""
+import argparse
+import json
+import os
+import sys
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(
+    0, os.path.join(DATA_DIR, "../rplugin/python3/deoplete/sources/deoplete_go")
+)
+import go_stdlibdb  # noqa: E402
+
+
+def read_artifact(path):
+    with open(path) as f:
+        return {k: [tuple(x) for x in v] for k, v in json.load(f)["packages"].items()}
+
+
+def read_directory(directory):
+    packages = dict()
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(root, name)
+            package = os.path.relpath(path, directory)[: -len(".json")]
+            parent, _, base = package.rpartition("/")
+            if parent == base:
+                # fmt/fmt.json is fmt, archive/tar.json is archive/tar
+                package = base
+            with open(path) as f:
+                result = json.load(f)
+            rows = result[1] if len(result) > 1 else []
+            packages[package] = [(x["name"], x["type"], x["class"]) for x in rows]
+    return packages
+
+
+def read_json(path):
+    if os.path.isdir(path):
+        return read_directory(path)
+    return read_artifact(path)
+
+
+def newest_version(json_dir):
+    def version(name):
+        return [int(x) if x.isdigit() else 0 for x in name.split(".")]
+
+    versions = [
+        x for x in os.listdir(json_dir) if os.path.isdir(os.path.join(json_dir, x))
+    ]
+    if not versions:
+        raise SystemExit("{}: no version directory".format(json_dir))
+    return max(versions, key=version)
+
+
+def convert(source, output):
+    packages = read_json(source)
+    go_stdlibdb.write(output, packages)
+    print(
+        "{}: {} packages, {} bytes".format(
+            os.path.relpath(output), len(packages), os.path.getsize(output)
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("platforms", nargs="*", metavar="GOOS_GOARCH")
+    parser.add_argument("--from-json", help="an artifact or a package directory")
+    parser.add_argument("-o", "--output", help="the database of --from-json")
+    parser.add_argument("--json-dir", default=os.path.join(DATA_DIR, "json"))
+    parser.add_argument("--go-version", help="default: the newest in --json-dir")
+    args = parser.parse_args()
+
+    if args.from_json:
+        output = args.output or args.from_json.rstrip("/").rsplit(".json", 1)[0] + ".db"
+        convert(args.from_json, output)
+        return
+
+    if not args.platforms:
+        parser.error("no platform, and no --from-json")
+    version = args.go_version or newest_version(args.json_dir)
+    for name in args.platforms:
+        base = os.path.join(args.json_dir, version, name.replace("/", "_"))
+        source = base + ".json" if os.path.isfile(base + ".json") else base
+        if not os.path.exists(source):
+            raise SystemExit("{}: no json, run gen_json.py".format(source))
+        convert(source, base + ".db")
+
+
+if __name__ == "__main__":
+    main()
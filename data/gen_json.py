@@ -1,70 +1,213 @@
 #!/usr/bin/env python3
+"""Generate the gocode results of the Go standard library packages.
+
+Writes one json/<version>/<GOOS>_<GOARCH>.json per platform, read by the
+stdlib cache (g:deoplete#sources#go#use_cache):
+
+    {"version": ..., "goos": ..., "goarch": ...,
+     "packages": {"<import path>": [[name, type, class], ...], ...},
+     "manifest": {"<import path>": "<fingerprint>", ...}}
+
+    ./gen_json.py linux amd64
+    ./gen_json.py --jobs 8 linux_amd64 darwin_amd64 windows_386
+
+gocode is queried in a process pool. A package whose fingerprint (gocode
+binary, Go version and package source directory) is unchanged since the
+last run is taken from the existing artifact instead of asking gocode.
+"""
+import argparse
+import hashlib
 import json
 import os
+import re
 import subprocess
 import sys
-import re
 
-def main():
-    base_offset = 41
-
-    go_version_raw = subprocess.Popen("go version",
-                                  shell=True,
-                                  stdout=subprocess.PIPE
-                                  ).stdout.read()
-
-    go_version = str(go_version_raw).split(' ')[2].strip('go')
-    go_os = sys.argv[1]
-    go_arch = sys.argv[2]
-
-    with open('./stdlib-' + go_version + '_' + go_os + '_' + go_arch + '.txt') as stdlib:
-        packages = stdlib.read().splitlines()
-
-    for pkg in packages:
-        template_file = './template.go'
-        f = open(template_file)
-        fs = f.read(-1)
-
-        func = None
-        if re.search(r'/', pkg):
-            library = str(pkg).split(r'/')[:-1]
-            func = str(pkg).split(r'/')[-1]
-        else:
-            library = pkg
-            func = pkg
-        source = str(fs).replace('IMPORT', pkg).replace('FUNC', func).encode()
-
-        offset = base_offset + (len(pkg) + len(func))
-
-        process = subprocess.Popen([FindBinaryPath('gocode'),
-                                    '-f=json',
-                                    'autocomplete',
-                                    template_file,
-                                    str(offset)],
-                                   stdin=subprocess.PIPE,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE,
-                                   start_new_session=True)
-        process.stdin.write(source)
-        stdout_data, stderr_data = process.communicate()
+from concurrent.futures import ProcessPoolExecutor
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE = os.path.join(DATA_DIR, "template.go")
+
+
+def get_go_version():
+    # go version go1.7.3 linux/amd64
+    out = subprocess.check_output(["go", "version"], universal_newlines=True)
+    return out.split()[2][len("go") :]
+
+
+def get_goroot():
+    try:
+        return subprocess.check_output(
+            ["go", "env", "GOROOT"], universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def parse_platforms(args):
+    """Accept "GOOS GOARCH" like the previous version, or GOOS_GOARCH pairs."""
+    if all(re.search(r"[_/]", x) for x in args):
+        return [tuple(re.split(r"[_/]", x, 1)) for x in args]
+    if len(args) % 2:
+        raise SystemExit("platforms must be GOOS GOARCH pairs or GOOS_GOARCH")
+    return list(zip(args[::2], args[1::2]))
+
+
+def read_packages(go_version, goos, goarch):
+    path = os.path.join(
+        DATA_DIR, "stdlib-{}_{}_{}.txt".format(go_version, goos, goarch)
+    )
+    if os.path.isfile(path):
+        with open(path) as f:
+            packages = f.read().splitlines()
+    else:
+        # no 'make data/stdlib-...' list for this platform
+        env = dict(os.environ, GOOS=goos, GOARCH=goarch)
+        out = subprocess.check_output(["go", "list", "std"], env=env)
+        packages = [
+            x
+            for x in out.decode().splitlines()
+            if "internal" not in x.split("/") and not x.startswith("vendor/")
+        ]
+    # the lists may repeat a package, e.g. unsafe
+    return sorted(set(x for x in packages if x))
+
+
+def fingerprint(gocode, go_version, goroot, package):
+    h = hashlib.sha1()
+    for path in [gocode, os.path.join(goroot, "src", package)]:
+        try:
+            st = os.stat(path)
+            h.update("{}:{}:{}".format(path, st.st_mtime, st.st_size).encode())
+        except OSError:
+            # cannot tell whether it changed
+            return None
+    h.update(go_version.encode())
+    return h.hexdigest()
+
+
+def query(job):
+    """Return (package, rows) of one gocode query, rows is None on error."""
+    gocode, goos, goarch, package = job
+    name = package.rsplit("/", 1)[-1]
+    with open(TEMPLATE) as f:
+        template = f.read()
+    source = template.replace("IMPORT", package).replace("FUNC", name)
+    offset = len(source[: source.index(name + ".\n")].encode()) + len(name) + 1
+
+    env = dict(os.environ, GOOS=goos, GOARCH=goarch)
+    process = subprocess.Popen(
+        [gocode, "-f=json", "autocomplete", TEMPLATE, str(offset)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+        env=env,
+    )
+    stdout_data, _ = process.communicate(source.encode())
+    try:
         result = json.loads(stdout_data.decode())
+    except ValueError:
+        return package, None
+    if len(result) < 2:
+        return package, []
+    return package, [[x["name"], x["type"], x["class"]] for x in result[1]]
 
-        out_dir = os.path.join(
-            './json', go_version, go_os + '_' + go_arch)
-        if not os.path.exists(out_dir):
-            os.makedirs(out_dir)
 
-        libdir = str(pkg).rsplit('/', 1)[0]
-        pkg_dir = os.path.join(out_dir, libdir)
-        if not os.path.exists(pkg_dir):
-            os.makedirs(pkg_dir)
-        out_path = \
-            os.path.join(pkg_dir, func + '.json')
-        out = open(out_path, 'w')
-        out.write(json.dumps(result, sort_keys=True))
-        out.close()
+def load_artifact(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"packages": {}, "manifest": {}}
 
-        print(pkg)
+
+def write_artifact(path, artifact):
+    data = json.dumps(artifact, sort_keys=True, separators=(",", ":"))
+    try:
+        with open(path) as f:
+            if f.read() == data:
+                return False
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("platforms", nargs="+", metavar="PLATFORM")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--go-version", help="default: the output of go version")
+    parser.add_argument("--gocode", default="gocode")
+    parser.add_argument("--output-dir", default=os.path.join(DATA_DIR, "json"))
+    parser.add_argument("--force", action="store_true", help="query every package")
+    args = parser.parse_args()
+
+    gocode = FindBinaryPath(args.gocode)
+    if not gocode:
+        raise SystemExit("gocode binary not found")
+    go_version = args.go_version or get_go_version()
+    goroot = get_goroot()
+
+    platforms = parse_platforms(args.platforms)
+    artifacts = dict()
+    jobs = []
+    for goos, goarch in platforms:
+        path = os.path.join(
+            args.output_dir, go_version, "{}_{}.json".format(goos, goarch)
+        )
+        old = load_artifact(path)
+        artifact = {
+            "version": go_version,
+            "goos": goos,
+            "goarch": goarch,
+            "packages": {},
+            "manifest": {},
+        }
+        for package in read_packages(go_version, goos, goarch):
+            stamp = fingerprint(gocode, go_version, goroot, package)
+            if (
+                not args.force
+                and stamp is not None
+                and old.get("manifest", {}).get(package) == stamp
+                and package in old.get("packages", {})
+            ):
+                artifact["packages"][package] = old["packages"][package]
+                artifact["manifest"][package] = stamp
+            else:
+                jobs.append((goos, goarch, package, stamp))
+        artifacts[(goos, goarch)] = (path, artifact)
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        results = executor.map(
+            query, [(gocode, goos, goarch, pkg) for goos, goarch, pkg, _ in jobs]
+        )
+        for (goos, goarch, _, stamp), (package, rows) in zip(jobs, results):
+            if rows is None:
+                failed += 1
+                print("{}_{}: {}: gocode failed".format(goos, goarch, package))
+                continue
+            _, artifact = artifacts[(goos, goarch)]
+            artifact["packages"][package] = rows
+            if stamp is not None:
+                artifact["manifest"][package] = stamp
+
+    for (goos, goarch), (path, artifact) in sorted(artifacts.items()):
+        changed = write_artifact(path, artifact)
+        print(
+            "{}: {} packages{}".format(
+                os.path.relpath(path),
+                len(artifact["packages"]),
+                "" if changed else " (unchanged)",
+            )
+        )
+    return 1 if failed else 0
 
 
 def FindBinaryPath(cmd):
@@ -81,6 +224,8 @@ def FindBinaryPath(cmd):
             binary = os.path.join(path, cmd)
             if is_exec(binary):
                 return binary
-    return print('gocode binary not found')
+    return ""
+
 
-main()
+if __name__ == "__main__":
+    sys.exit(main())
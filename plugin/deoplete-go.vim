@@ -30,3 +30,16 @@ let g:deoplete#sources#go#cgo =
 
 let g:deoplete#sources#go#on_event = 
       \ get(g:, 'deoplete#sources#go#on_event', 0)
+
+let g:deoplete#sources#go#profile =
+      \ get(g:, 'deoplete#sources#go#profile', 0)
+
+let g:deoplete#sources#go#profile_file =
+      \ get(g:, 'deoplete#sources#go#profile_file',
+      \     (exists('$XDG_CACHE_HOME') ? $XDG_CACHE_HOME : expand('~/.cache'))
+      \     . '/deoplete/go/profile.json')
+
+" Show the latency of each completion stage recorded by
+" g:deoplete#sources#go#profile
+command! DeopleteGoProfile
+      \ execute 'pedit' fnameescape(g:deoplete#sources#go#profile_file)
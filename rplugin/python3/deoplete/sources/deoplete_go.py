@@ -1,42 +1,36 @@
 import os
 import re
-import platform
-import subprocess
-
-from collections import OrderedDict
+import time
 
 from deoplete.base.source import Base
-from deoplete.util import charpos2bytepos, expand, getlines, load_external_module
+from deoplete.util import expand, getlines, load_external_module
 
 load_external_module(__file__, "sources/deoplete_go")
-from cgo import cgo
-from stdlib import stdlib
-
-try:
-    load_external_module(__file__, "")
-    from ujson import loads
-except ImportError:
-    from json import loads
-
-# from https://github.com/golang/go/blob/go1.13beta1/src/go/build/syslist.go
-known_goos = (
-    "aix",
-    "android",
-    "appengine",
-    "darwin",
-    "dragonfly",
-    "freebsd",
-    "hurd",
-    "illumos",
-    "js",
-    "linux",
-    "nacl",
-    "netbsd",
-    "openbsd",
-    "plan9",
-    "solaris",
-    "windows",
-    "zos",
+
+# ujson.so is built into rplugin/python3/deoplete by make ujson
+load_external_module(__file__, "")
+
+from go_buffer import BufferSnapshot
+from go_buildctx import BuildContext
+from go_candidates import CandidateBuilder
+from go_cache import (
+    CgoCache,
+    ResultCache,
+    StdlibCache,
+    default_cache_directory,
+    default_goarch,
+    default_goos,
+    find_json_directory,
+)
+from go_client import GocodeClient, Request
+from go_decoder import CLASS, NAME
+from go_imports import ImportIndex, default_name, ends_in_code
+import go_jsonbackend
+from go_resolver import GocodeResolver
+import profiler
+
+plugin_directory = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "..", "..")
 )
 
 
@@ -49,6 +43,8 @@ class Source(Base):
         self.filetypes = ["go"]
         self.input_pattern = r"(?:\b[^\W\d]\w*|[\]\)])\.(?:[^\W\d]\w*)?"
         self.rank = 500
+        self.events = ["BufEnter", "BufWritePost"]
+        self.environ = None
 
     def on_init(self, context):
         vars = context["vars"]
@@ -81,10 +77,31 @@ class Source(Base):
         if "deoplete#sources#go#goarch" in vars:
             self.goarch = vars["deoplete#sources#go#goarch"]
 
+        self.build_context = BuildContext(self.auto_goos, self.goos, self.goarch)
+
         self.sock = ""
         if "deoplete#sources#go#sock" in vars:
             self.sock = vars["deoplete#sources#go#sock"]
 
+        self.daemon = False
+        if "deoplete#sources#go#daemon" in vars:
+            self.daemon = vars["deoplete#sources#go#daemon"]
+
+        self.client = None
+        if self.daemon and self.sock in ["unix", "tcp"]:
+            self.client = GocodeClient(self.sock)
+
+        self.async_complete = False
+        if "deoplete#sources#go#async" in vars:
+            self.async_complete = vars["deoplete#sources#go#async"]
+        self.request = None
+        self.request_anchor = None
+        self.error_time, self.error_interval = 0.0, 5.0
+
+        self.result_cache = ResultCache()
+        self.snapshot = BufferSnapshot()
+        self.imports = ImportIndex()
+
         self.cgo = False
         if "deoplete#sources#go#cgo" in vars:
             self.cgo = vars["deoplete#sources#go#cgo"]
@@ -109,17 +126,64 @@ class Source(Base):
         if "deoplete#sources#go#fallback_to_source" in vars:
             self.fallback_to_source = vars["deoplete#sources#go#fallback_to_source"]
 
-        self.loaded_gocode_binary = False
+        self.use_cache = False
+        if "deoplete#sources#go#use_cache" in vars:
+            self.use_cache = vars["deoplete#sources#go#use_cache"]
+
+        self.json_directory = ""
+        if "deoplete#sources#go#json_directory" in vars:
+            self.json_directory = expand(vars["deoplete#sources#go#json_directory"])
+
+        if self.use_cache and self.json_directory == "":
+            from stdlib import find_goroot, get_go_version
+
+            self.json_directory = find_json_directory(
+                os.path.join(plugin_directory, "data", "json"),
+                get_go_version(find_goroot()),
+            )
+            # the data of another Go version misses or invents members,
+            # gocode completes them instead
+            self.use_cache = self.json_directory != ""
+
+        if self.use_cache:
+            # (GOOS, GOARCH) -> StdlibCache, per the build context of a buffer
+            self.stdlib_caches = dict()
+            # a package name, not a field of x.fmt
+            self.selector_pattern = re.compile(r"(?<![\w.])([^\W\d]\w*)\.(\w*)$")
+
+        self.max_candidates = 0
+        if "deoplete#sources#go#max_candidates" in vars:
+            self.max_candidates = vars["deoplete#sources#go#max_candidates"]
+        # deoplete would filter a capped list, which misses the matches of a
+        # longer input, so every keystroke is gathered again
+        self.is_volatile = bool(self.max_candidates)
+
+        self.builder = CandidateBuilder(
+            self.package_dot, self.pointer, self.sort_class, self.max_candidates
+        )
+
+        profiler.configure(
+            vars.get("deoplete#sources#go#profile", 0),
+            expand(vars.get("deoplete#sources#go#profile_file", "")),
+        )
+
+        self.json_backend = vars.get("deoplete#sources#go#json_backend", "auto")
+        if self.json_backend not in go_jsonbackend.backends + ("auto",):
+            self.print_error("unknown json_backend: " + str(self.json_backend))
+        go_jsonbackend.configure(
+            self.json_backend,
+            os.path.join(plugin_directory, "benchmark", "json", "gocode.json"),
+        )
+
+        self.gocode = GocodeResolver(self.gocode_binary, self.print_error)
         self.complete_pos = re.compile(r'\w*$|(?<=")[./\-\w]*$')
 
         if self.pointer:
             self.complete_pos = re.compile(self.complete_pos.pattern + r"|\*$")
             self.input_pattern += r"|\*"
 
+        self.cgo_prewarm, self.cgo_prewarmer = False, None
         if self.cgo:
-            load_external_module(__file__, "clang")
-            import clang.cindex as clang
-
             self.libclang_path = vars.get("deoplete#sources#go#cgo#libclang_path", "")
             if self.libclang_path == "":
                 return
@@ -129,236 +193,350 @@ class Source(Base):
                 "sort_algo": vars.get("deoplete#sources#cgo#sort_algo", None),
             }
 
-            if (
-                not clang.Config.loaded
-                and clang.Config.library_path != self.libclang_path
-            ):
-                clang.Config.set_library_file(self.libclang_path)
-                clang.Config.set_compatibility_check(False)
-
             # Set 'C.' complete pattern
             self.cgo_complete_pattern = re.compile(r"[^\W\d]*C\.")
-            # Create clang.cindex.Index database
-            self.index = clang.Index.create(0)
-            # initialize in-memory cache
-            self.cgo_cache, self.cgo_inline_source = dict(), None
+            self.cgo_cache_directory = expand(
+                vars.get(
+                    "deoplete#sources#go#cgo#cache_directory",
+                    default_cache_directory("cgo"),
+                )
+            )
+            self.cgo_cache_size = vars.get("deoplete#sources#go#cgo#cache_size", 64)
+            self.cgo_prewarm = vars.get("deoplete#sources#go#cgo#prewarm", 0)
+            self.cgo_prewarm_jobs = vars.get("deoplete#sources#go#cgo#prewarm_jobs", 1)
+            self.cgo_prewarm_wait = vars.get("deoplete#sources#go#cgo#prewarm_wait", 50)
+            # libclang is loaded by load_cgo() on the first cgo buffer
+            self.index = None
+
+    def on_event(self, context):
+        # $GOPATH may be changed per project, e.g. by an autocmd
+        if self.environ is not None and self.environ["GOPATH"] != self.vim.eval("$GOPATH"):
+            self.environ = None
+
+        if self.cgo and self.cgo_prewarm:
+            self.prewarm_cgo(context)
+
+    def load_cgo(self):
+        """Load libclang, and create the cgo completion state."""
+        load_external_module(__file__, "clang")
+        import clang.cindex as clang
+        from cgo import Preamble, PrefixIndex, Prewarmer, TranslationUnits
+
+        if (
+            not clang.Config.loaded
+            and clang.Config.library_path != self.libclang_path
+        ):
+            clang.Config.set_library_file(self.libclang_path)
+            clang.Config.set_compatibility_check(False)
+
+        # Create clang.cindex.Index database
+        self.index = clang.Index.create(0)
+        # initialize in-memory and on-disk cache
+        self.cgo_cache = CgoCache(
+            self.cgo_cache_directory,
+            self.get_libclang_version(),
+            max_disk_size=self.cgo_cache_size << 20,
+        )
+        self.cgo_inline_source, self.cgo_candidates = None, None
+        self.cgo_prefix_index = PrefixIndex([])
+        self.cgo_preamble = Preamble()
+        self.cgo_units = TranslationUnits()
+
+        if self.cgo_prewarm:
+            # prewarm parses use their own Index, the TranslationUnits
+            # of self.index are not thread-safe
+            self.cgo_prewarm_index = clang.Index.create(0)
+            self.cgo_prewarmer = Prewarmer(self.cgo_prewarm_jobs)
+
+    def prewarm_cgo(self, context):
+        from cgo import Preamble, cgo
+
+        bufnr = context.get("bufnr", self.vim.current.buffer.number)
+        count, source = Preamble().update(getlines(self.vim)).inline_source
+        if count == 0:
+            if self.cgo_prewarmer is not None:
+                self.cgo_prewarmer.cancel(bufnr)
+            return
+        if self.index is None:
+            self.load_cgo()
+
+        # the candidates are stored in self.cgo_cache for cgo_completion
+        self.cgo_prewarmer.submit(
+            bufnr,
+            source,
+            cgo.complete,
+            self.cgo_prewarm_index,
+            self.cgo_cache,
+            self.cgo_options,
+            count,
+            source,
+        )
+
+    def get_environ(self):
+        if self.environ is None:
+            self.environ = os.environ.copy()
+            self.environ["GOPATH"] = self.vim.eval("$GOPATH")
+        return self.environ
+
+    def get_cursor_line(self, context):
+        if "position" in context:
+            return context["position"][1]
+        return self.vim.current.window.cursor[0]
+
+    def get_libclang_version(self):
+        # the library itself identifies the version of its results
+        try:
+            st = os.stat(self.libclang_path)
+        except OSError:
+            return self.libclang_path
+        return "{}:{}:{}".format(self.libclang_path, st.st_size, st.st_mtime)
 
     def get_complete_position(self, context):
         m = self.complete_pos.search(context["input"])
         return m.start() if m else -1
 
+    @profiler.profile
     def gather_candidates(self, context):
         # If enabled self.cgo, and matched self.cgo_complete_pattern pattern
         if self.cgo and self.cgo_complete_pattern.search(context["input"]):
-            return self.cgo_completion(getlines(self.vim))
+            line = self.get_cursor_line(context)
+            with profiler.stage("buffer"):
+                snapshot = self.snapshot.update(self.vim, context, line)
+            return self.cgo_completion(context, snapshot)
 
         if self.cgo_only:
             return []
 
-        bufname = self.vim.current.buffer.name
-        if not os.path.isfile(bufname):
-            bufname = self.vim.call("tempname")
-        result = self.get_complete_result(context, getlines(self.vim), bufname)
+        line = self.get_cursor_line(context)
+
+        result = None
+        if self.async_complete:
+            key = (self.vim.current.buffer.number, line, context["input"])
+            result = self.poll_request(context, key)
+
+        if result is None:
+            with profiler.stage("buffer"):
+                snapshot = self.snapshot.update(self.vim, context, line)
+
+            if self.use_cache:
+                with profiler.stage("cache.stdlib"):
+                    result = self.get_cache_result(context, snapshot)
+
+        if result is None:
+            with profiler.stage("cache.result"):
+                anchor = self.get_anchor(context, snapshot)
+                prefix = context["input"][context["complete_position"] :]
+                result = self.result_cache.get(anchor, prefix)
+
+        if result is None:
+            bufname = self.vim.current.buffer.name
+            if not os.path.isfile(bufname):
+                bufname = self.vim.call("tempname")
+            if self.async_complete:
+                self.request = self.new_request(context, snapshot, bufname)
+                if self.request is not None:
+                    self.request.key = key
+                    self.request_anchor = (anchor, prefix)
+                    self.request.start(self.client)
+                    result = self.poll_request(context, key)
+            else:
+                result = self.get_complete_result(
+                    context, snapshot, bufname, (anchor, prefix)
+                )
 
         try:
-            if result[1][0]["class"] == "PANIC":
+            if result[1][0][CLASS] == "PANIC":
                 self.print_error("gocode panicked")
                 return []
 
-            if self.sort_class:
-                class_dict = OrderedDict((x, []) for x in self.sort_class)
-
-            out = []
-            sep = " "
-
-            for complete in result[1]:
-                word = complete["name"]
-                info = complete["type"]
-                _class = complete["class"]
-                abbr = str(word + sep + info).replace(" func", "", 1)
-                kind = _class
-
-                if _class == "package" and self.package_dot:
-                    word += "."
-                if (
-                    self.pointer
-                    and str(context["input"][context["complete_position"] :]) == "*"
-                ):
-                    word = "*" + word
-
-                candidates = dict(word=word, abbr=abbr, kind=kind, info=info, dup=1)
+            with profiler.stage("build"):
+                return self.builder.build(result[1], context)
+        except Exception:
+            return []
 
-                if not self.sort_class or _class == "import":
-                    out.append(candidates)
-                elif _class in class_dict.keys():
-                    class_dict[_class].append(candidates)
+    @profiler.profile
+    def cgo_completion(self, context, snapshot):
+        from cgo import PrefixIndex, cgo
 
-            if self.sort_class:
-                for v in class_dict.values():
-                    out += v
+        if self.index is None:
+            with profiler.stage("cgo.load"):
+                self.load_cgo()
 
-            return out
-        except Exception:
-            return []
+        with profiler.stage("cgo.preamble"):
+            count, inline_source = self.cgo_preamble.update(snapshot.lines).inline_source
 
-    def cgo_completion(self, buffer):
         # No include header
-        if cgo.get_inline_source(buffer)[0] == 0:
+        if count == 0:
             return
 
-        count, inline_source = cgo.get_inline_source(buffer)
+        if self.cgo_prewarmer is not None:
+            # rather than parsing the same preamble twice, but without
+            # blocking on a long parse: deoplete polls again while is_async
+            done = self.cgo_prewarmer.wait(
+                snapshot.bufnr, inline_source, self.cgo_prewarm_wait / 1000
+            )
+            context["is_async"] = not done
+            if not done:
+                return []
 
         # exists 'self.cgo_inline_source', same inline sources and
-        # already cached cgo complete candidates
+        # already completed candidates
         if (
-            self.cgo_inline_source is not None
-            and self.cgo_inline_source == inline_source
-            and self.cgo_cache[self.cgo_inline_source]
+            self.cgo_inline_source is None
+            or self.cgo_inline_source != inline_source
+            or not self.cgo_candidates
         ):
-            # Use in-memory(self.cgo_headers) cacahe
-            return self.cgo_cache[self.cgo_inline_source]
-        else:
             self.cgo_inline_source = inline_source
-            # return candidates use libclang-python3
-            return cgo.complete(
+            # return candidates use libclang-python3, or self.cgo_cache
+            self.cgo_candidates = cgo.complete(
                 self.index,
                 self.cgo_cache,
                 self.cgo_options,
                 count,
                 self.cgo_inline_source,
+                self.cgo_units,
+                snapshot.bufnr,
             )
 
-    def get_complete_result(self, context, buffer, bufname):
-        offset = self.get_cursor_offset(context)
-
-        env = os.environ.copy()
-        env["GOPATH"] = self.vim.eval("$GOPATH")
-
-        if self.auto_goos:
-            name = os.path.basename(os.path.splitext(bufname)[0])
-            if "_" in name:
-                for part in name.rsplit("_", 2):
-                    if part in known_goos:
-                        env["GOOS"] = part
-                        break
-            if "GOOS" not in env:
-                for line in buffer:
-                    if line.startswith("package "):
-                        break
-                    elif not line.startswith("// +build"):
-                        continue
-                    directives = [x.split(",", 1)[0] for x in line[9:].strip().split()]
-                    if platform.system().lower() not in directives:
-                        for plat in directives:
-                            if plat in known_goos:
-                                env["GOOS"] = plat
-                                break
-        elif self.goos != "":
-            env["GOOS"] = self.goos
-
-        if "GOOS" in env and env["GOOS"] != platform.system().lower():
-            env["CGO_ENABLED"] = "0"
-
-        if self.goarch != "":
-            env["GOARCH"] = self.goarch
-
-        gocode = self.find_gocode_binary()
-        if not gocode:
+        if self.cgo_prefix_index.candidates is not self.cgo_candidates:
+            with profiler.stage("cgo.index"):
+                self.cgo_prefix_index = PrefixIndex(self.cgo_candidates)
+        with profiler.stage("cgo.query"):
+            return self.cgo_prefix_index.query(
+                context["input"][context["complete_position"] :], self.max_candidates
+            )
+
+    def get_cache_result(self, context, snapshot):
+        m = self.selector_pattern.search(context["input"])
+        if not m or not ends_in_code(context["input"]):
+            return None
+
+        package = self.resolve_stdlib_package(m.group(1), snapshot)
+        if package is None:
+            return None
+
+        stdlib_cache = self.get_stdlib_cache(snapshot)
+        if not stdlib_cache.exists(package):
+            return None
+        candidates = stdlib_cache.get(package)
+        if candidates is None:
+            return None
+        prefix = m.group(2)
+        if self.max_candidates and prefix:
+            # filtered before the cap, like the gocode results
+            candidates = [x for x in candidates if x[NAME].startswith(prefix)]
+        return [len(prefix), candidates]
+
+    def get_stdlib_cache(self, snapshot):
+        """Return the StdlibCache of the platform gocode would complete for."""
+        with profiler.stage("buildctx"):
+            env = self.build_context.resolve(self.vim.current.buffer.name, snapshot)
+        goos = env.get("GOOS") or default_goos()
+        key = (goos, env.get("GOARCH") or default_goarch())
+        stdlib_cache = self.stdlib_caches.get(key)
+        if stdlib_cache is None:
+            stdlib_cache = StdlibCache(self.json_directory, *key)
+            self.stdlib_caches[key] = stdlib_cache
+        return stdlib_cache
+
+    def resolve_stdlib_package(self, name, snapshot):
+        with profiler.stage("imports"):
+            package = self.imports.update(snapshot).lookup(name)
+        if package is None:
+            return None
+        from stdlib import stdlib
+
+        if package not in stdlib.lookup(default_name(package)):
+            # not a standard library package
+            return None
+        return package
+
+    def poll_request(self, context, key):
+        """Return the result of the in-flight gocode request for key.
+
+        Returns None if there is no such request; a request started for a
+        different input is superseded and killed. While gocode is still
+        running, context["is_async"] is set so deoplete polls again.
+        """
+        request = self.request
+        if request is None:
+            return None
+        if request.key != key:
+            request.cancel()
+            self.request = None
+            return None
+
+        context["is_async"] = not request.done()
+        if context["is_async"]:
             return []
-        args = [gocode, "-f=json"]
+
+        self.request = None
+        return self.decode_result(request, self.request_anchor)
+
+    @profiler.profile
+    def get_complete_result(self, context, snapshot, bufname, anchor=None):
+        request = self.new_request(context, snapshot, bufname)
+        if request is None:
+            return []
+
+        if self.client is not None:
+            self.client.autocomplete(request)
+        else:
+            request.run()
+        return self.decode_result(request, anchor)
+
+    def new_request(self, context, snapshot, bufname):
+        offset = snapshot.get_offset(context["input"], context["complete_position"])
+
+        env = dict(self.get_environ())
+        with profiler.stage("buildctx"):
+            env.update(self.build_context.resolve(bufname, snapshot))
+
+        gocode = self.gocode.resolve()
+        if not gocode:
+            return None
+        flags = []
         if self.source_importer:
-            args.append("-source")
+            flags.append("-source")
         if self.builtin_objects:
-            args.append("-builtin")
+            flags.append("-builtin")
         if self.unimported_packages:
-            args.append("-unimported-packages")
+            flags.append("-unimported-packages")
         if self.fallback_to_source:
-            args.append("-fallback-to-source")
+            flags.append("-fallback-to-source")
         # basically, '-sock' option for mdempsky/gocode.
         # probably meaningless in nsf/gocode that already run the rpc server
         if self.sock != "" and self.sock in ["unix", "tcp", "none"]:
-            args.append("-sock={}".format(self.sock))
+            flags.append("-sock={}".format(self.sock))
+        # e.g. nsf/gocode exits on -source
+        args = [gocode, "-f=json"] + [x for x in flags if self.gocode.supports(x)]
 
         args += ["autocomplete", bufname, str(offset)]
 
-        process = subprocess.Popen(
-            args,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            start_new_session=True,
-            env=env,
-        )
-        stdout_data, stderr_data = process.communicate("\n".join(buffer).encode())
-
-        result = []
-        try:
-            result = loads(stdout_data.decode())
-        except Exception as e:
-            self.print_error("gocode decode error")
-            self.print_error(stdout_data.decode())
-            self.print_error(stderr_data.decode())
+        # a partial result is only valid in gocode order
+        limit = 0 if self.sort_class else self.max_candidates
+        return Request(args, env, snapshot.data, limit=limit)
+
+    def decode_result(self, request, anchor=None):
+        if request.decoder.error is not None and not request.cancelled:
+            # at most one report per error_interval, gocode is called per keystroke
+            now = time.monotonic()
+            if now - self.error_time >= self.error_interval:
+                self.error_time = now
+                self.print_error("gocode decode error: " + request.decoder.error)
+                if request.stderr_data:
+                    self.print_error(request.stderr_data[:200].decode(errors="replace"))
+
+        result = request.result
+        if anchor is not None and not request.decoder.truncated:
+            self.result_cache.set(*anchor, result)
         return result
 
-    def get_cursor_offset(self, context):
-        line = self.vim.current.window.cursor[0]
+    def get_anchor(self, context, snapshot):
         column = context["complete_position"]
-        count = self.vim.call("line2byte", line)
-        if self.vim.current.buffer.options["fileformat"] == "dos":
-            # Note: line2byte() counts "\r\n" in DOS format.  It must be "\n"
-            # in gocode.
-            count -= line - 1
-        return count + charpos2bytepos("utf-8", context["input"][:column], column) - 1
-
-    def parse_import_package(self, buffer):
-        start = 0
-        packages = []
-
-        for line, b in enumerate(buffer):
-
-            if re.match(r"^\s*import \w*|^\s*import \(", b):
-                start = line
-                continue
-            elif re.match(r"\)", b):
-                break
-            elif line > start:
-                package_name = re.sub(r'\t|"', "", b)
-                if str(package_name).find(r"/", 0) > 0:
-                    full_package_name = str(package_name).split("/", -1)
-                    package_name = full_package_name[len(full_package_name) - 1]
-                    library = (
-                        "/".join(full_package_name[: len(full_package_name) - 1]),
-                    )
-
-                    packages.append(dict(library=library, package=package_name))
-                else:
-                    packages.append(dict(library="none", package=package_name))
-        return packages
-
-    def find_gocode_binary(self):
-        if self.gocode_binary != "" and self.loaded_gocode_binary:
-            return self.gocode_binary
-
-        self.loaded_gocode_binary = os.path.isfile(self.gocode_binary)
-        if self.loaded_gocode_binary:
-            return self.gocode_binary
-        elif platform.system().lower() == "windows":
-            return self.find_binary_path("gocode.exe")
-        else:
-            return self.find_binary_path("gocode")
-
-    def find_binary_path(self, path):
-        def is_exec(bin_path):
-            return os.path.isfile(bin_path) and os.access(bin_path, os.X_OK)
-
-        dirpath, binary = os.path.split(path)
-        if dirpath:
-            if is_exec(path):
-                return path
-        else:
-            for p in os.environ["PATH"].split(os.pathsep):
-                p = p.strip('"')
-                binary = os.path.join(p, path)
-                if is_exec(binary):
-                    return binary
-        return self.print_error(path + " binary not found")
+        return (
+            self.vim.current.buffer.name,
+            snapshot.get_offset(context["input"], column),
+            snapshot.get_hash(),
+            context["input"][:column],
+        )
@@ -1,40 +1,238 @@
+import heapq
 import os
 import re
+import threading
 
+from bisect import bisect_left
+from collections import OrderedDict
+
+import profiler
+from go_candidates import Candidate
 from clang_index import Clang_Index
+from go_pkgconfig import PkgConfig
 
 
-class cgo(object):
-    def get_inline_source(buffer):
-        # TODO(zchee): very slow. about 100ms
+class Preamble(object):
+    """The cgo preamble of a buffer, the comment just above import "C".
+
+    update() remembers the lines up to import "C" (or up to the first
+    declaration when there is none), and returns the cached preamble as long
+    as those lines are unchanged, without scanning the rest of the buffer.
+    A buffer with neither is scanned again by every update().
+    """
+
+    declarations = ("func ", "type ", "var ", "const ")
+
+    def __init__(self):
+        self.buffer = None
+        self.head = None
+        # index of the 'import "C"' line, or -1
+        self.import_line = -1
+        self.count = 0
+        self.source = ""
+        self.hash = hash(self.source)
+
+    def update(self, buffer):
+        if buffer is self.buffer:
+            return self
+        self.buffer = buffer
+        if self.head is not None and buffer[: len(self.head)] == self.head:
+            return self
+
+        end = len(buffer)
+        self.import_line = -1
+        for i, line in enumerate(buffer):
+            if line == 'import "C"':
+                self.import_line = end = i
+                break
+            # imports precede the other top-level declarations
+            if line.startswith(self.declarations):
+                end = i
+                break
+        # a line appended after a head ending the buffer may be import "C"
+        self.head = buffer[: end + 1] if end < len(buffer) else None
+
+        if self.import_line < 0:
+            self.count, self.source = 0, ""
+        else:
+            c_inline = self.parse(buffer[: self.import_line])
+            self.count, self.source = len(c_inline), "\n".join(c_inline)
+        self.hash = hash(self.source)
+        return self
+
+    def parse(self, c_inline):
+        if c_inline and c_inline[-1] == "*/":
+            for i in range(len(c_inline) - 2, 0, -1):
+                if c_inline[i] == "/*":
+                    return c_inline[i + 1 : -1]
+        return c_inline
+
+    @property
+    def inline_source(self):
+        return (self.count, self.source)
+
+
+class TranslationUnits(object):
+    """libclang TranslationUnits kept per buffer.
+
+    A buffer whose preamble changed is reparsed with its unsaved file
+    instead of parsed from scratch, so libclang reuses the precompiled
+    preamble (PARSE_PRECOMPILED_PREAMBLE) of the included headers. Only the
+    max_size most recently used units are kept alive.
+    """
+
+    def __init__(self, max_size=4):
+        self.max_size = max_size
+        self.units = OrderedDict()
+
+    def get(self, index, key, fname, flags, files, options):
+        entry = self.units.get(key)
+        if entry is not None and entry[0] == flags:
+            tu = entry[1]
+            tu.reparse(unsaved_files=files)
+            self.units.move_to_end(key)
+            return tu
+
+        # new buffer, or the cgo flags changed
+        tu = index.parse(fname, flags, unsaved_files=files, options=options)
+        self.units[key] = (flags, tu)
+        self.units.move_to_end(key)
+        if len(self.units) > self.max_size:
+            self.units.popitem(last=False)
+        return tu
+
+
+class PrefixIndex(object):
+    """The cgo candidates of a preamble, sorted by word for prefix queries.
+
+    query() bisects the lowercased words for the candidates starting with
+    a prefix, and returns them in the original (sort_algo) order. A prefix
+    with an upper case letter matches case-sensitively.
+    """
+
+    def __init__(self, candidates):
+        self.candidates = candidates
+        words = [x.word.lower() for x in candidates]
+        # ranks[i] is the position in candidates of the i-th smallest word
+        self.ranks = sorted(range(len(words)), key=words.__getitem__)
+        self.words = [words[i] for i in self.ranks]
+
+    def query(self, prefix, limit=0):
+        if not prefix:
+            ranks = range(len(self.candidates))
+        else:
+            lower = prefix.lower()
+            start = bisect_left(self.words, lower)
+            end = bisect_left(self.words, lower + "\U0010ffff", start)
+            ranks = self.ranks[start:end]
+            if lower != prefix:
+                candidates = self.candidates
+                ranks = [i for i in ranks if candidates[i].word.startswith(prefix)]
+
+        if limit and len(ranks) > limit:
+            ranks = heapq.nsmallest(limit, ranks)
+        else:
+            ranks = sorted(ranks)
+        # only the returned slice is converted to dicts
+        return [self.candidates[i].to_dict() for i in ranks]
 
-        if 'import "C"' not in buffer:
-            return (0, "")
 
-        pos_import_c = list(buffer).index('import "C"')
-        c_inline = buffer[:pos_import_c]
+class Prewarmer(object):
+    """Complete cgo preambles on background threads before C. is typed.
 
-        if c_inline[len(c_inline) - 1] == "*/":
-            comment_start = next(
-                i
-                for i, v in zip(range(len(c_inline) - 1, 0, -1), reversed(c_inline))
-                if v == "/*"
-            )
-            c_inline = c_inline[comment_start + 1 : len(c_inline) - 1]
+    Each buffer has a generation, bumped by every submit() and cancel(), so
+    a job whose buffer got a newer preamble in the meantime is dropped
+    before it parses. At most max_parses jobs run libclang at a time.
+    """
+
+    def __init__(self, max_parses=1):
+        self.semaphore = threading.BoundedSemaphore(max_parses)
+        self.lock = threading.Lock()
+        self.generations = dict()
+        # key -> (source, threading.Event) of the newest job
+        self.pending = dict()
+
+    def submit(self, key, source, func, *args):
+        done = threading.Event()
+        with self.lock:
+            generation = self.generations.get(key, 0) + 1
+            self.generations[key] = generation
+            self.pending[key] = (source, done)
+
+        def target():
+            try:
+                with self.semaphore:
+                    if self.generations.get(key) == generation:
+                        func(*args)
+            except Exception:
+                pass
+            finally:
+                done.set()
+                with self.lock:
+                    if self.pending.get(key, (None, None))[1] is done:
+                        del self.pending[key]
+
+        threading.Thread(target=target, daemon=True).start()
+
+    def cancel(self, key):
+        with self.lock:
+            self.generations[key] = self.generations.get(key, 0) + 1
+            self.pending.pop(key, None)
+
+    def wait(self, key, source, timeout=None):
+        """Wait for the job of key if it is completing source.
 
-        return (len(c_inline), "\n".join(c_inline))
+        Returns False if the job is still running after timeout seconds.
+        """
+        with self.lock:
+            source_done = self.pending.get(key)
+        if source_done is not None and source_done[0] == source:
+            return source_done[1].wait(timeout)
+        return True
 
+
+class cgo(object):
+    pkg_config = PkgConfig()
+
+    # enum CXCompletionChunkKind
+    CHUNK_TYPED_TEXT = 1
+    CHUNK_RESULT_TYPE = 15
+
+    # Go string to C string
+    #  The C string is allocated in the C heap using malloc.
+    #  It is the caller's responsibility to arrange for it to be
+    #  freed, such as by calling C.free (be sure to include stdlib.h
+    #  if C.free is needed).
+    #  func C.CString(string) *C.char
+    #
+    # Go []byte slice to C array
+    #  The C array is allocated in the C heap using malloc.
+    #  It is the caller's responsibility to arrange for it to be
+    #  freed, such as by calling C.free (be sure to include stdlib.h
+    #  if C.free is needed).
+    #  func C.CBytes([]byte) unsafe.Pointer
+    #
+    # C string to Go string
+    #  func C.GoString(*C.char) string
+    #
+    # C data with explicit length to Go string
+    #  func C.GoStringN(*C.char, C.int) string
+    #
+    # C data with explicit length to Go []byte
+    #  func C.GoBytes(unsafe.Pointer, C.int) []byte
+    builtins = (
+        Candidate("CString", "CString(string) *C.char", "function"),
+        Candidate("CBytes", "CBytes([]byte) unsafe.Pointer", "function"),
+        Candidate("GoString", "GoString(*C.char) string", "function"),
+        Candidate("GoStringN", "GoStringN(*C.char, C.int) string", "function"),
+        Candidate("GoBytes", "GoBytes(unsafe.Pointer, C.int) []byte", "function"),
+    )
+
+    @profiler.timer("cgo.pkgconfig")
     def get_pkgconfig(packages):
-        out = []
-        pkgconfig = cgo.find_binary_path("pkg-config")
-        if pkgconfig != "":
-            for pkg in packages:
-                flag = os.popen(pkgconfig + " " + pkg + " --cflags --libs").read()
-                out += flag.rstrip().split(" ")
-        return out
+        return cgo.pkg_config.flags(packages)
 
     def parse_candidates(result):
-        completion = {"dup": 1, "word": ""}
         _type = ""
         word = ""
         placeholder = ""
@@ -45,7 +243,7 @@ class cgo(object):
 
             # ignore inline fake main(void), and '_' prefix function
             if chunk_spelling == "main" or chunk_spelling.find("_") == 0:
-                return completion
+                return None
 
             if chunk.isKindTypedText():
                 word += chunk_spelling
@@ -55,34 +253,108 @@ class cgo(object):
             else:
                 placeholder += chunk_spelling
 
-        completion["word"] = word
-        completion["abbr"] = completion["info"] = placeholder + sep + _type
-
-        completion["kind"] = " ".join(
-            [
-                (
-                    Clang_Index.kinds[result.cursorKind]
-                    if (result.cursorKind in Clang_Index.kinds)
-                    else str(result.cursorKind)
-                )
-            ]
-        )
+        if not word:
+            return None
+
+        kind = Clang_Index.kinds.get(result.cursorKind)
+        if kind is None:
+            kind = str(result.cursorKind)
+        return Candidate(word, placeholder + sep + _type, kind)
+
+    def extract_candidates(results):
+        """Return the Candidates of libclang code-completion results.
+
+        The chunks are read with the libclang functions directly, one kind
+        and one text call per chunk, instead of through the CompletionString
+        and CompletionChunk objects of clang.cindex, which call libclang
+        again for every isKind*() and spelling.
+        """
+        try:
+            from clang.cindex import conf
+
+            lib = conf.lib
+            num_chunks = lib.clang_getNumCompletionChunks
+            chunk_kind = lib.clang_getCompletionChunkKind
+            chunk_text = lib.clang_getCompletionChunkText
+        except (ImportError, AttributeError):
+            return [x for x in map(cgo.parse_candidates, results) if x is not None]
+
+        kinds = Clang_Index.kinds
+        get_text = cgo.get_text
+        out = []
+        for result in results:
+            cs = result.completionString
+            word = []
+            placeholder = []
+            _type = []
+            for i in range(num_chunks(cs)):
+                spelling = get_text(chunk_text(cs, i))
+                if not spelling:
+                    continue
+                # ignore inline fake main(void), and '_' prefix function
+                if spelling == "main" or spelling[0] == "_":
+                    break
+                kind = chunk_kind(cs, i)
+                if kind == cgo.CHUNK_TYPED_TEXT:
+                    word.append(spelling)
+                    placeholder.append(spelling)
+                elif kind == cgo.CHUNK_RESULT_TYPE:
+                    _type.append(spelling)
+                else:
+                    placeholder.append(spelling)
+            else:
+                if word:
+                    kind = kinds.get(result.cursorKind)
+                    if kind is None:
+                        kind = str(result.cursorKind)
+                    out.append(
+                        Candidate(
+                            "".join(word),
+                            "".join(placeholder) + " " + "".join(_type),
+                            kind,
+                        )
+                    )
+        return out
+
+    def get_text(value):
+        # clang.cindex converts the CXString of clang_getCompletionChunkText
+        # with an errcheck, but not every version of the bindings does
+        if value is None or isinstance(value, str):
+            return value
+        if isinstance(value, bytes):
+            return value.decode("utf-8", "replace")
+        from clang.cindex import _CXString
+
+        return _CXString.from_result(value)
 
-        return completion
+    @profiler.timer("cgo.complete")
+    def complete(
+        index, cache, cgo_options, line_count, source, units=None, unit_key=None
+    ):
+        """Return the C candidates of the cgo preamble source.
 
-    def complete(index, cache, cgo_options, line_count, source):
+        cache is a go_cache.CgoCache, units an optional TranslationUnits keyed
+        by unit_key.
+        """
         cgo_pattern = r"#cgo (\S+): (.+)"
         flags = set()
+        packages = []
         for key, value in re.findall(cgo_pattern, source):
             if key == "pkg-config":
-                for flag in cgo.get_pkgconfig(value.split()):
-                    flags.add(flag)
+                packages += value.split()
             else:
                 if "${SRCDIR}" in key:
                     key = key.replace("${SRCDIR}", "./")
                 flags.add("%s=%s" % (key, value))
+        # resolve the packages of all the pkg-config lines at once
+        flags.update(cgo.get_pkgconfig(packages))
 
-        cgo_flags = ["-std", cgo_options["std"]] + list(flags)
+        cgo_flags = ["-std", cgo_options["std"]] + sorted(flags)
+
+        cache_key = cache.key(source, cgo_flags)
+        candidates = cache.get(cache_key)
+        if candidates is not None:
+            return candidates
 
         fname = "cgo_inline.c"
         main = """
@@ -102,8 +374,11 @@ class cgo(object):
         # PARSE_INCLUDE_BRIEF_COMMENTS_IN_CODE_COMPLETION = 128
         options = 15
 
-        # Index.parse(path, args=None, unsaved_files=None, options = 0)
-        tu = index.parse(fname, cgo_flags, unsaved_files=files, options=options)
+        if units is None:
+            # Index.parse(path, args=None, unsaved_files=None, options = 0)
+            tu = index.parse(fname, cgo_flags, unsaved_files=files, options=options)
+        else:
+            tu = units.get(index, unit_key, fname, cgo_flags, files, options)
 
         # TranslationUnit.codeComplete(path, line, column, ...)
         cr = tu.codeComplete(
@@ -123,67 +398,17 @@ class cgo(object):
         else:
             results = cr.results
 
-        # Go string to C string
-        #  The C string is allocated in the C heap using malloc.
-        #  It is the caller's responsibility to arrange for it to be
-        #  freed, such as by calling C.free (be sure to include stdlib.h
-        #  if C.free is needed).
-        #  func C.CString(string) *C.char
-        #
-        # Go []byte slice to C array
-        #  The C array is allocated in the C heap using malloc.
-        #  It is the caller's responsibility to arrange for it to be
-        #  freed, such as by calling C.free (be sure to include stdlib.h
-        #  if C.free is needed).
-        #  func C.CBytes([]byte) unsafe.Pointer
-        #
-        # C string to Go string
-        #  func C.GoString(*C.char) string
-        #
-        # C data with explicit length to Go string
-        #  func C.GoStringN(*C.char, C.int) string
-        #
-        # C data with explicit length to Go []byte
-        #  func C.GoBytes(unsafe.Pointer, C.int) []byte
-        cache[source] = [
-            {
-                "word": "CString",
-                "abbr": "CString(string) *C.char",
-                "info": "CString(string) *C.char",
-                "kind": "function",
-                "dup": 1,
-            },
-            {
-                "word": "CBytes",
-                "abbr": "CBytes([]byte) unsafe.Pointer",
-                "info": "CBytes([]byte) unsafe.Pointer",
-                "kind": "function",
-                "dup": 1,
-            },
-            {
-                "word": "GoString",
-                "abbr": "GoString(*C.char) string",
-                "info": "GoString(*C.char) string",
-                "kind": "function",
-                "dup": 1,
-            },
-            {
-                "word": "GoStringN",
-                "abbr": "GoStringN(*C.char, C.int) string",
-                "info": "GoStringN(*C.char, C.int) string",
-                "kind": "function",
-                "dup": 1,
-            },
-            {
-                "word": "GoBytes",
-                "abbr": "GoBytes(unsafe.Pointer, C.int) []byte",
-                "info": "GoBytes(unsafe.Pointer, C.int) []byte",
-                "kind": "function",
-                "dup": 1,
-            },
-        ]
-        cache[source] += list(map(cgo.parse_candidates, results))
-        return cache[source]
+        # shared by the candidates of every preamble
+        candidates = list(cgo.builtins)
+        with profiler.stage("cgo.extract"):
+            candidates += cgo.extract_candidates(results)
+
+        try:
+            headers = [x.include.name for x in tu.get_includes()]
+        except Exception:
+            headers = []
+        cache.set(cache_key, candidates, headers)
+        return candidates
 
     def get_priority(x):
         return x.string.priority
@@ -0,0 +1,126 @@
+from deoplete.util import charpos2bytepos, getlines
+
+
+class BufferSnapshot(object):
+    """UTF-8 snapshot of the current buffer as gocode reads it from stdin.
+
+    The encoded lines are kept between requests. Nothing is fetched while
+    b:changedtick is unchanged, and after an edit only the lines that differ
+    from the previous snapshot are encoded again. The buffer is split at the
+    cursor line, so the bytes around the line being typed are reused as is.
+    """
+
+    def __init__(self):
+        self.bufnr = None
+        self.changedtick = None
+        self.lines = []
+        self.encoded = []
+        self.line = 0
+        self.head = b""
+        self.tail = b""
+        self.current = b""
+        self.outer_changed = True
+        self.outer_hash = None
+        # index of the first line changed by the last update, or len(lines)
+        self.first_changed = 0
+        # index of the package clause, and a counter of the edits before it
+        self.header_end = -1
+        self.header_tick = 0
+
+    def update(self, vim, context, line):
+        """Update the snapshot and split it at the cursor line (1-based)."""
+        bufnr = context.get("bufnr", vim.current.buffer.number)
+        changedtick = context.get("changedtick")
+
+        if (
+            changedtick is not None
+            and bufnr == self.bufnr
+            and changedtick == self.changedtick
+        ):
+            self.first_changed = len(self.lines)
+        elif bufnr != self.bufnr:
+            self.reset(bufnr, getlines(vim))
+        else:
+            self.merge(getlines(vim), line)
+        self.changedtick = changedtick
+
+        if self.first_changed <= self.header_end or self.header_end < 0:
+            self.update_header()
+
+        if line != self.line or self.outer_changed:
+            self.split(line)
+        i = line - 1
+        self.current = self.encoded[i] if 0 <= i < len(self.encoded) else b""
+        return self
+
+    def update_header(self):
+        end = len(self.lines)
+        for i, line in enumerate(self.lines):
+            if line.startswith("package "):
+                end = i
+                break
+        self.header_end = end
+        self.header_tick += 1
+
+    def reset(self, bufnr, lines):
+        self.bufnr = bufnr
+        self.header_end = -1
+        self.lines = lines
+        self.encoded = [x.encode() for x in lines]
+        self.first_changed = 0
+        self.outer_changed = True
+
+    def merge(self, lines, line):
+        old = self.lines
+        i = line - 1
+        if (
+            len(lines) == len(old)
+            and 0 <= i < len(lines)
+            and lines[:i] == old[:i]
+            and lines[i + 1 :] == old[i + 1 :]
+        ):
+            # typing on the cursor line, the common case
+            if lines[i] == old[i]:
+                self.first_changed = len(lines)
+            else:
+                self.first_changed = i
+                self.encoded[i] = lines[i].encode()
+            self.lines = lines
+            return
+
+        common = min(len(lines), len(old))
+        start = 0
+        while start < common and lines[start] == old[start]:
+            start += 1
+        end = 0
+        while end < common - start and lines[-1 - end] == old[-1 - end]:
+            end += 1
+
+        self.encoded[start : len(old) - end] = [
+            x.encode() for x in lines[start : len(lines) - end]
+        ]
+        self.lines = lines
+        self.first_changed = start
+        self.outer_changed = True
+
+    def split(self, line):
+        i = max(line - 1, 0)
+        self.head = b"\n".join(self.encoded[:i] + [b""]) if i else b""
+        self.tail = b"\n".join([b""] + self.encoded[i + 1 :])
+        self.line = line
+        self.outer_changed = False
+        self.outer_hash = None
+
+    @property
+    def data(self):
+        return self.head + self.current + self.tail
+
+    def get_hash(self):
+        """Hash of the buffer outside the cursor line."""
+        if self.outer_hash is None:
+            self.outer_hash = hash((self.head, self.tail))
+        return self.outer_hash
+
+    def get_offset(self, text, column):
+        """Byte offset of column in the cursor line, text is the line input."""
+        return len(self.head) + charpos2bytepos("utf-8", text[:column], column)
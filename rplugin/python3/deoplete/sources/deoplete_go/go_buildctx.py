@@ -0,0 +1,326 @@
+import os
+import platform
+import re
+from collections import OrderedDict
+
+from go_cache import default_goarch
+
+# from go tool dist list of go1.21
+known_platforms = {
+    "aix": ("ppc64",),
+    "android": ("386", "amd64", "arm", "arm64"),
+    "darwin": ("amd64", "arm64"),
+    "dragonfly": ("amd64",),
+    "freebsd": ("386", "amd64", "arm", "arm64", "riscv64"),
+    "illumos": ("amd64",),
+    "ios": ("amd64", "arm64"),
+    "js": ("wasm",),
+    "linux": (
+        "386",
+        "amd64",
+        "arm",
+        "arm64",
+        "loong64",
+        "mips",
+        "mipsle",
+        "mips64",
+        "mips64le",
+        "ppc64",
+        "ppc64le",
+        "riscv64",
+        "s390x",
+    ),
+    "netbsd": ("386", "amd64", "arm", "arm64"),
+    "openbsd": ("386", "amd64", "arm", "arm64"),
+    "plan9": ("386", "amd64", "arm"),
+    "solaris": ("amd64",),
+    "wasip1": ("wasm",),
+    "windows": ("386", "amd64", "arm", "arm64"),
+}
+
+known_goos = tuple(known_platforms)
+
+known_goarch = (
+    "386",
+    "amd64",
+    "arm",
+    "arm64",
+    "loong64",
+    "mips",
+    "mipsle",
+    "mips64",
+    "mips64le",
+    "ppc64",
+    "ppc64le",
+    "riscv64",
+    "s390x",
+    "wasm",
+)
+
+# tried first when the configured platform does not satisfy a constraint,
+# e.g. // +build !linux picks darwin rather than aix
+common_goos = ("linux", "darwin", "windows")
+common_goarch = ("amd64", "arm64")
+
+unix_goos = frozenset(
+    (
+        "aix",
+        "android",
+        "darwin",
+        "dragonfly",
+        "freebsd",
+        "hurd",
+        "illumos",
+        "ios",
+        "linux",
+        "netbsd",
+        "openbsd",
+        "solaris",
+    )
+)
+
+# GOOS matching the tag of another GOOS too
+implied_goos = {"android": "linux", "illumos": "solaris", "ios": "darwin"}
+
+token_pattern = re.compile(r"\(|\)|!|&&|\|\||[^\s()!&|]+")
+
+
+def parse_go_build(expr):
+    """Parse a //go:build expression to nested tuples.
+
+    ("tag", name), ("not", x), ("and", x, y) and ("or", x, y). Raises
+    ValueError when expr is malformed.
+    """
+    tokens = token_pattern.findall(expr)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        if pos >= len(tokens):
+            raise ValueError("unexpected end of " + expr)
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or():
+        x = parse_and()
+        while peek() == "||":
+            take()
+            x = ("or", x, parse_and())
+        return x
+
+    def parse_and():
+        x = parse_not()
+        while peek() == "&&":
+            take()
+            x = ("and", x, parse_not())
+        return x
+
+    def parse_not():
+        token = take()
+        if token == "!":
+            return ("not", parse_not())
+        if token == "(":
+            x = parse_or()
+            if take() != ")":
+                raise ValueError("missing ) in " + expr)
+            return x
+        if token in (")", "&&", "||"):
+            raise ValueError("unexpected {} in {}".format(token, expr))
+        return ("tag", token)
+
+    x = parse_or()
+    if pos != len(tokens):
+        raise ValueError("unexpected {} in {}".format(tokens[pos], expr))
+    return x
+
+
+def parse_plus_build(lines):
+    """Convert // +build lines to the tuples of parse_go_build.
+
+    Options separated by spaces are or'ed, terms separated by commas are
+    and'ed, and the lines are and'ed.
+    """
+
+    def term(x):
+        if x.startswith("!"):
+            return ("not", ("tag", x[1:]))
+        return ("tag", x)
+
+    def join(op, xs):
+        x = xs[0]
+        for y in xs[1:]:
+            x = (op, x, y)
+        return x
+
+    return join(
+        "and",
+        [
+            join("or", [join("and", [term(t) for t in o.split(",")]) for o in line])
+            for line in lines
+        ],
+    )
+
+
+def evaluate(x, tags):
+    op = x[0]
+    if op == "tag":
+        return x[1] in tags
+    if op == "not":
+        return not evaluate(x[1], tags)
+    if op == "and":
+        return evaluate(x[1], tags) and evaluate(x[2], tags)
+    return evaluate(x[1], tags) or evaluate(x[2], tags)
+
+
+def get_constraint(header):
+    """Return the build constraint of the lines before the package clause."""
+    go_build = None
+    plus_build = []
+    for line in header:
+        line = line.strip()
+        if line.startswith("//go:build"):
+            go_build = line[len("//go:build") :]
+        elif line.startswith("// +build"):
+            options = line[len("// +build") :].split()
+            if options:
+                plus_build.append(options)
+    try:
+        # //go:build supersedes // +build, like go1.17
+        if go_build is not None:
+            return parse_go_build(go_build)
+        if plus_build:
+            return parse_plus_build(plus_build)
+    except ValueError:
+        pass
+    return None
+
+
+def get_filename_constraint(bufname):
+    """Return the (GOOS, GOARCH) of a name_GOOS_GOARCH.go file, or ""."""
+    name = os.path.splitext(os.path.basename(bufname))[0]
+    # the part before the first _ never constrains, e.g. linux.go
+    parts = name.split("_")[1:]
+    if parts and parts[-1] == "test":
+        parts.pop()
+    if len(parts) >= 2 and parts[-2] in known_goos and parts[-1] in known_goarch:
+        return parts[-2], parts[-1]
+    if parts and parts[-1] in known_goos:
+        return parts[-1], ""
+    if parts and parts[-1] in known_goarch:
+        return "", parts[-1]
+    return "", ""
+
+
+def preferred(first, common, known):
+    """Return first, then the common and the other known values, once each."""
+    return list(OrderedDict.fromkeys((first,) + common + known))
+
+
+class BuildContext(object):
+    """Environment of the gocode request of a buffer.
+
+    With auto, GOOS and GOARCH are taken from a name_GOOS_GOARCH.go file
+    name, or else chosen to satisfy the //go:build (or // +build)
+    constraint of the buffer, preferring the configured ones. CGO_ENABLED is
+    1 when the constraint requires cgo, and 0 for another platform.
+
+    The environment is computed once per buffer header: the cache key is
+    the buffer name and BufferSnapshot.header_tick.
+    """
+
+    def __init__(self, auto=False, goos="", goarch=""):
+        self.auto = auto
+        self.host_goos = platform.system().lower()
+        self.host_goarch = default_goarch()
+        self.goos = goos
+        self.goarch = goarch
+        # bufnr -> (key, env)
+        self.entries = dict()
+
+    def resolve(self, bufname, snapshot):
+        key = (bufname, snapshot.header_tick)
+        entry = self.entries.get(snapshot.bufnr)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        env = self.get_env(bufname, snapshot.lines[: snapshot.header_end])
+        self.entries[snapshot.bufnr] = (key, env)
+        return env
+
+    def get_tags(self, goos, goarch, cgo):
+        tags = {goos, goarch, "gc"}
+        if goos in implied_goos:
+            tags.add(implied_goos[goos])
+        if goos in unix_goos:
+            tags.add("unix")
+        if cgo:
+            tags.add("cgo")
+        # any release
+        tags.update("go1.%d" % i for i in range(1, 100))
+        return tags
+
+    def get_env(self, bufname, header):
+        goos = self.goos or os.environ.get("GOOS", "") or self.host_goos
+        goarch = self.goarch or os.environ.get("GOARCH", "") or self.host_goarch
+        cgo = None
+
+        if self.auto:
+            file_goos, file_goarch = get_filename_constraint(bufname)
+            goos = file_goos or goos
+            goarch = file_goarch or goarch
+            constraint = get_constraint(header)
+            # e.g. a wasm file is built for js/wasm, not for linux/wasm
+            if constraint is not None or not self.is_valid(goos, goarch):
+                if file_goos:
+                    goos_list = [file_goos]
+                else:
+                    goos_list = preferred(goos, common_goos, known_goos)
+                if file_goarch:
+                    goarch_list = [file_goarch]
+                else:
+                    goarch_list = preferred(goarch, common_goarch, known_goarch)
+                found = self.satisfy(constraint, goos_list, goarch_list)
+                # nothing satisfies e.g. the ignore tag
+                if found is not None:
+                    goos, goarch, cgo = found
+
+        env = dict()
+        if goos != self.host_goos or self.goos:
+            env["GOOS"] = goos
+        if goarch != self.host_goarch or self.goarch:
+            env["GOARCH"] = goarch
+
+        if cgo is not None:
+            env["CGO_ENABLED"] = "1" if cgo else "0"
+        elif goos != self.host_goos or goarch != self.host_goarch:
+            # go build disables cgo for another platform
+            env["CGO_ENABLED"] = "0"
+        return env
+
+    def is_valid(self, goos, goarch):
+        if (goos, goarch) == (self.host_goos, self.host_goarch):
+            return True
+        return goarch in known_platforms.get(goos, ())
+
+    def satisfy(self, constraint, goos_list, goarch_list):
+        """Return the first valid (GOOS, GOARCH, cgo) satisfying constraint.
+
+        cgo is True or False when only that value satisfies it, or None.
+        A None constraint is satisfied by any platform. The preferred GOOS
+        with any GOARCH is tried before the other GOOS.
+        """
+        for o in goos_list:
+            for a in goarch_list:
+                if not self.is_valid(o, a):
+                    continue
+                if constraint is None:
+                    return o, a, None
+                without = evaluate(constraint, self.get_tags(o, a, False))
+                with_cgo = evaluate(constraint, self.get_tags(o, a, True))
+                if without and with_cgo:
+                    return o, a, None
+                if without or with_cgo:
+                    return o, a, with_cgo
+        return None
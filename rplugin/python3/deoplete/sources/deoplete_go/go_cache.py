@@ -0,0 +1,365 @@
+import gzip
+import hashlib
+import json
+import os
+import platform
+import re
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+
+from go_candidates import Candidate
+from go_decoder import CLASS, NAME
+from go_jsonbackend import loads
+from go_stdlibdb import StdlibDatabase
+
+# platform.machine() to GOARCH
+known_goarch = {
+    "x86_64": "amd64",
+    "amd64": "amd64",
+    "i386": "386",
+    "i686": "386",
+    "x86": "386",
+    "aarch64": "arm64",
+    "arm64": "arm64",
+    "armv6l": "arm",
+    "armv7l": "arm",
+    "ppc64le": "ppc64le",
+    "s390x": "s390x",
+}
+
+
+def default_goos():
+    return os.environ.get("GOOS", platform.system().lower())
+
+
+def default_goarch():
+    if "GOARCH" in os.environ:
+        return os.environ["GOARCH"]
+    machine = platform.machine().lower()
+    return known_goarch.get(machine, machine)
+
+
+class StdlibCache(object):
+    """Pre-generated gocode results of the Go standard library packages.
+
+    The packed <directory>/<GOOS>_<GOARCH>.db of data/gen_db.py is mapped
+    on the first lookup, and only the members of the looked up package are
+    decoded. Otherwise the <directory>/<GOOS>_<GOARCH>.json artifact of
+    data/gen_json.py is loaded on the first lookup, or with the older layout
+    of one <directory>/<GOOS>_<GOARCH>/<parent>/<name>.json file per package,
+    each file on the first lookup of its package. Converted packages are
+    kept in memory up to max_size packages.
+    """
+
+    def __init__(self, directory, goos="", goarch="", max_size=64):
+        self.goos = goos or default_goos()
+        self.goarch = goarch or default_goarch()
+        self.max_size = max_size
+        self.packages = OrderedDict()
+        self.artifact = None
+        self.artifact_path = ""
+
+        name = self.goos + "_" + self.goarch
+        platform_dir = os.path.join(directory, name)
+        if os.path.isfile(directory):
+            # json_directory points to the artifact itself
+            self.artifact_path = directory
+            self.directory = os.path.dirname(directory)
+        elif os.path.isfile(platform_dir + ".db"):
+            self.artifact_path = platform_dir + ".db"
+            self.directory = directory
+        elif os.path.isfile(platform_dir + ".json"):
+            self.artifact_path = platform_dir + ".json"
+            self.directory = directory
+        elif os.path.isdir(platform_dir):
+            self.directory = platform_dir
+        else:
+            # json_directory already points to the <GOOS>_<GOARCH> directory
+            self.directory = directory
+
+    def path(self, package):
+        if "/" in package:
+            return os.path.join(self.directory, package + ".json")
+        return os.path.join(self.directory, package, package + ".json")
+
+    def exists(self, package):
+        if package in self.packages:
+            return True
+        if self.artifact_path:
+            return package in self.load_artifact()
+        return os.path.isfile(self.path(package))
+
+    def load_artifact(self):
+        if self.artifact is None:
+            try:
+                if self.artifact_path.endswith(".db"):
+                    self.artifact = StdlibDatabase(self.artifact_path)
+                else:
+                    with open(self.artifact_path) as f:
+                        self.artifact = loads(f.read())["packages"]
+            except (OSError, ValueError, KeyError):
+                self.artifact = dict()
+        return self.artifact
+
+    def get(self, package):
+        if package in self.packages:
+            self.packages.move_to_end(package)
+            return self.packages[package]
+
+        if self.artifact_path:
+            rows = self.load_artifact().get(package)
+            if not rows:
+                return None
+            # the rows of the database are tuples already
+            candidates = [tuple(x) for x in rows]
+        else:
+            try:
+                with open(self.path(package)) as f:
+                    result = loads(f.read())
+            except (OSError, ValueError):
+                return None
+
+            if len(result) < 2 or not result[1]:
+                return None
+
+            candidates = [(x["name"], x["type"], x["class"]) for x in result[1]]
+        self.packages[package] = candidates
+        if len(self.packages) > self.max_size:
+            self.packages.popitem(last=False)
+        return candidates
+
+
+def find_json_directory(base, go_version):
+    """Return the directory under base (data/json) generated for go_version.
+
+    The standard library API only changes with the minor version, so go1.21.6
+    matches the newest 1.21.x directory. Returns "" when there is none.
+    """
+
+    def version(name):
+        return [int(x) if x.isdigit() else 0 for x in name.split(".")]
+
+    m = re.match(r"(?:go)?(\d+)\.(\d+)", go_version)
+    if not m or not os.path.isdir(base):
+        return ""
+    pattern = re.compile(r"{}\.{}(?:\.|$)".format(*m.groups()))
+    versions = sorted((x for x in os.listdir(base) if pattern.match(x)), key=version)
+    return os.path.join(base, versions[-1]) if versions else ""
+
+
+class ResultCache(object):
+    """gocode results keyed on the completion anchor.
+
+    While the identifier after a selector grows (fmt.P, fmt.Pr, ...), the
+    anchor stays the same and the cached candidates are narrowed in-process
+    instead of asking gocode again. The key of an anchor contains the hash of
+    the buffer outside the current line, so editing elsewhere invalidates it.
+    """
+
+    def __init__(self, max_size=16, max_age=30.0):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.hashes = dict()
+
+    def invalidate(self, bufname, buffer_hash):
+        if self.hashes.get(bufname, buffer_hash) != buffer_hash:
+            for key in [x for x in self.entries if x[0] == bufname]:
+                del self.entries[key]
+        self.hashes[bufname] = buffer_hash
+
+    identifier = re.compile(r"\w*$")
+
+    def get(self, key, prefix):
+        if not self.identifier.match(prefix):
+            return None
+        self.invalidate(key[0], key[2])
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        created, cached_prefix, candidates = entry
+        if time.monotonic() - created > self.max_age:
+            del self.entries[key]
+            return None
+        # gocode filtered the candidates by cached_prefix already
+        if not prefix.startswith(cached_prefix):
+            return None
+
+        self.entries.move_to_end(key)
+        if prefix != cached_prefix:
+            candidates = [x for x in candidates if x[NAME].startswith(prefix)]
+        return [len(prefix), candidates]
+
+    def set(self, key, prefix, result):
+        if not self.identifier.match(prefix):
+            return
+        if len(result) < 2 or not result[1] or result[1][0][CLASS] == "PANIC":
+            return
+
+        self.invalidate(key[0], key[2])
+        self.entries[key] = (time.monotonic(), prefix, result[1])
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class CgoCache(object):
+    """cgo completion candidates, kept in memory and on disk.
+
+    Entries are keyed by the hash of the cgo preamble, the resolved cgo
+    flags and the libclang version, so a new session does not run libclang
+    again for the same preamble. The mtime of every included header is
+    stored with the candidates, and an entry is dropped when a header
+    changed. The in-memory layer keeps the max_size most recently used
+    entries, and the directory at most max_disk_size bytes: the least
+    recently used files (by mtime, touched on load) are removed by save().
+    """
+
+    def __init__(self, directory, version, max_size=8, max_disk_size=64 << 20):
+        self.directory = directory
+        self.version = version
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self.entries = OrderedDict()
+        # the candidates may be prewarmed on another thread
+        self.lock = threading.RLock()
+
+    def key(self, source, flags):
+        h = hashlib.sha1()
+        for x in [self.version, source] + list(flags):
+            h.update(x.encode("utf-8", "surrogateescape"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json.gz")
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            entry = self.load(key)
+            if entry is None:
+                return None
+            self.store(key, entry)
+
+        headers, candidates = entry
+        if not self.is_fresh(headers):
+            self.remove(key)
+            return None
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+        return candidates
+
+    def set(self, key, candidates, headers):
+        entry = ({x: mtime(x) for x in headers}, candidates)
+        self.store(key, entry)
+        if self.directory:
+            try:
+                self.save(key, entry)
+            except OSError:
+                pass
+
+    def store(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+        if self.directory:
+            remove_file(self.path(key))
+
+    def is_fresh(self, headers):
+        return all(mtime(x) == t for x, t in headers.items())
+
+    def load(self, key):
+        if not self.directory:
+            return None
+        path = self.path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = loads(f.read())
+            # for the eviction of the least recently used files
+            os.utime(path)
+        except (OSError, ValueError, EOFError):
+            return None
+        candidates = [Candidate(*x) for x in data["candidates"]]
+        return data["headers"], candidates
+
+    def save(self, key, entry):
+        headers, candidates = entry
+        data = {
+            "headers": headers,
+            "candidates": [[x.word, x.abbr, x.kind] for x in candidates],
+        }
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # unique per thread, the prewarm threads save too
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(
+                    gzip.compress(json.dumps(data, separators=(",", ":")).encode())
+                )
+            os.replace(tmp, path)
+        except OSError:
+            os.unlink(tmp)
+            raise
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Remove the oldest files while the directory exceeds max_disk_size."""
+        files = []
+        total = 0
+        now = time.time()
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(".tmp"):
+                    # left by an interrupted save
+                    if now - st.st_mtime > 3600:
+                        remove_file(path)
+                    continue
+                if name.endswith(".json.gz"):
+                    files.append((st.st_mtime, st.st_size, path))
+                    total += st.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_disk_size:
+                break
+            if path != keep:
+                remove_file(path)
+                total -= size
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def default_cache_directory(*names):
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "deoplete", "go", *names)
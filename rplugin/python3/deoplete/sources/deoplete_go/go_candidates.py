@@ -0,0 +1,108 @@
+import sys
+
+from collections import OrderedDict
+from itertools import islice
+
+
+class Candidate(object):
+    """A cached candidate, converted to a deoplete dict by to_dict().
+
+    The info of a candidate always equals its abbr, and the kind strings
+    are interned, so a record holds three references instead of a five-key
+    dict.
+    """
+
+    __slots__ = ("word", "abbr", "kind")
+
+    def __init__(self, word, abbr, kind):
+        self.word = word
+        self.abbr = abbr
+        self.kind = sys.intern(kind)
+
+    def to_dict(self):
+        return {
+            "word": self.word,
+            "abbr": self.abbr,
+            "info": self.abbr,
+            "kind": self.kind,
+            "dup": 1,
+        }
+
+
+class CandidateBuilder(object):
+    """Convert decoded gocode (name, type, class) tuples to deoplete candidates.
+
+    The options are fixed when the builder is created. The type part of the
+    abbr is memoized by gocode type string, which is shared by many members
+    and reused by the next request completing the same package.
+    """
+
+    def __init__(
+        self,
+        package_dot=False,
+        pointer=False,
+        sort_class=None,
+        max_candidates=0,
+        max_memo=20000,
+    ):
+        self.package_dot = package_dot
+        self.pointer = pointer
+        self.sort_class = list(sort_class or [])
+        self.max_candidates = max_candidates
+        self.max_memo = max_memo
+        self.suffixes = dict()
+
+    def get_suffix(self, info):
+        # word has no space, so this equals (word + " " + info).replace(...)
+        if len(self.suffixes) >= self.max_memo:
+            self.suffixes.clear()
+        suffix = self.suffixes[info] = (" " + info).replace(" func", "", 1)
+        return suffix
+
+    def build(self, candidates, context):
+        pointer = (
+            self.pointer and context["input"][context["complete_position"] :] == "*"
+        )
+        package_dot = self.package_dot
+        suffixes = self.suffixes
+        get_suffix = self.get_suffix
+
+        out = []
+        if self.sort_class:
+            class_dict = OrderedDict((x, []) for x in self.sort_class)
+            # "import" candidates are always listed first
+            class_dict["import"] = out
+        else:
+            class_dict = None
+            if self.max_candidates:
+                candidates = islice(candidates, self.max_candidates)
+
+        for word, info, kind in candidates:
+            if class_dict is None:
+                bucket = out
+            else:
+                bucket = class_dict.get(kind)
+                if bucket is None:
+                    continue
+
+            suffix = suffixes.get(info)
+            if suffix is None:
+                suffix = get_suffix(info)
+            abbr = word + suffix
+
+            if package_dot and kind == "package":
+                word += "."
+            if pointer:
+                word = "*" + word
+
+            bucket.append(
+                {"word": word, "abbr": abbr, "kind": kind, "info": info, "dup": 1}
+            )
+
+        if class_dict is not None:
+            for v in class_dict.values():
+                if v is not out:
+                    out += v
+            if self.max_candidates:
+                del out[self.max_candidates :]
+        return out
@@ -0,0 +1,343 @@
+import atexit
+import os
+import platform
+import re
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+import go_gob
+import profiler
+from go_cache import default_goarch
+from go_decoder import StreamDecoder
+
+
+class Request(object):
+    """One gocode client invocation.
+
+    run() blocks until gocode exits, decoding its stdout while it is read.
+    start() runs it on a thread instead, so the caller can poll done() and
+    cancel() a request that is no longer needed.
+    """
+
+    def __init__(self, args, env, data, key=None, limit=0):
+        self.args = args
+        self.env = env
+        self.data = data
+        self.key = key
+        self.limit = limit
+        self.process = None
+        self.returncode = None
+        self.decoder = StreamDecoder(limit)
+        self.received = 0
+        self.stderr_data = b""
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def run(self):
+        self.decoder = StreamDecoder(self.limit)
+        self.received = 0
+        with tempfile.TemporaryFile() as stderr:
+            with self.lock:
+                if self.cancelled:
+                    return self
+                self.process = subprocess.Popen(
+                    self.args,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr,
+                    start_new_session=True,
+                    env=self.env,
+                )
+            self.communicate()
+            stderr.seek(0)
+            self.stderr_data = stderr.read(4096)
+        return self
+
+    def communicate(self):
+        process = self.process
+        try:
+            # gocode reads the whole stdin before it writes anything
+            process.stdin.write(self.data)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+        stdout = process.stdout.fileno()
+        with profiler.stage("gocode.spawn"):
+            # until the first output, mostly gocode itself
+            chunk = os.read(stdout, 65536)
+        decoding = 0.0
+        while not self.decoder.done:
+            start = profiler.clock()
+            if chunk:
+                self.received += len(chunk)
+                self.decoder.feed(chunk)
+            else:
+                self.decoder.close()
+            decoding += profiler.clock() - start
+            if not chunk:
+                break
+            chunk = os.read(stdout, 65536)
+        if profiler.enabled:
+            profiler.record("gocode.decode", decoding)
+
+        if process.poll() is None and self.decoder.done:
+            # the limit is reached, or the output is broken
+            process.kill()
+        process.stdout.close()
+        self.returncode = process.wait()
+
+    @property
+    def result(self):
+        return self.decoder.result
+
+    def start(self, client=None):
+        def target():
+            try:
+                if client is not None:
+                    client.autocomplete(self)
+                else:
+                    self.run()
+            except OSError:
+                self.returncode = -1
+            finally:
+                self.finished.set()
+
+        threading.Thread(target=target, daemon=True).start()
+        return self
+
+    def done(self):
+        return self.finished.is_set()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.process is not None and self.process.poll() is None:
+                self.process.kill()
+
+
+# the net/rpc types of mdempsky/gocode and stamblerre/gocode
+packed_context = go_gob.Struct(
+    "PackedContext",
+    [
+        ("GOARCH", go_gob.STRING),
+        ("GOOS", go_gob.STRING),
+        ("GOROOT", go_gob.STRING),
+        ("GOPATH", go_gob.STRING),
+        ("CgoEnabled", go_gob.BOOL),
+        ("UseAllFiles", go_gob.BOOL),
+        ("Compiler", go_gob.STRING),
+        ("BuildTags", go_gob.Slice(go_gob.STRING)),
+        ("ReleaseTags", go_gob.Slice(go_gob.STRING)),
+        ("InstallSuffix", go_gob.STRING),
+    ],
+)
+autocomplete_request = go_gob.Struct(
+    "AutoCompleteRequest",
+    [
+        ("Filename", go_gob.STRING),
+        ("Data", go_gob.BYTES),
+        ("Cursor", go_gob.INT),
+        ("Context", packed_context),
+        ("Source", go_gob.BOOL),
+        ("Builtin", go_gob.BOOL),
+        ("IgnoreCase", go_gob.BOOL),
+        ("UnimportedPackages", go_gob.BOOL),
+        ("FallbackToSource", go_gob.BOOL),
+    ],
+)
+
+
+class GocodeClient(object):
+    """Send completion requests to one gocode daemon over its RPC socket.
+
+    gocode -s serves the Server.AutoComplete net/rpc method on
+    -sock=unix|tcp. The client keeps one connection to it, so a completion
+    costs no process spawn. When the daemon cannot be reached, it is
+    started (or restarted after it died, at most once per restart_interval)
+    and the request retried once. If that fails too, or the daemon serves
+    another protocol (e.g. nsf/gocode), the request spawns the gocode
+    client as before.
+    """
+
+    def __init__(self, sock, restart_interval=5.0, timeout=30.0):
+        self.sock = sock
+        self.restart_interval = restart_interval
+        self.timeout = timeout
+        self.server = None
+        self.started = 0.0
+        self.connection = None
+        self.rpc = True
+        self.release_tags = dict()
+        # requests run on the async request threads
+        self.lock = threading.RLock()
+        atexit.register(self.shutdown)
+
+    def is_running(self):
+        return self.server is not None and self.server.poll() is None
+
+    def start(self, gocode, env):
+        with self.lock:
+            if self.is_running():
+                return True
+
+            # Do not respawn in a loop when the daemon cannot start, e.g.
+            # another daemon already listens on the socket.
+            now = time.monotonic()
+            if now - self.started < self.restart_interval:
+                return False
+            self.started = now
+
+            try:
+                self.server = subprocess.Popen(
+                    [gocode, "-s", "-sock={}".format(self.sock)],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    start_new_session=True,
+                    env=env,
+                )
+            except OSError:
+                self.server = None
+                return False
+            return True
+
+    def stop(self):
+        with self.lock:
+            self.disconnect()
+            if self.is_running():
+                self.server.terminate()
+                try:
+                    self.server.wait(timeout=1)
+                except subprocess.TimeoutExpired:
+                    self.server.kill()
+            self.server = None
+
+    def shutdown(self):
+        # a request thread may be waiting for the daemon at exit
+        if self.lock.acquire(timeout=1):
+            try:
+                self.stop()
+            finally:
+                self.lock.release()
+
+    def get_address(self, env):
+        if self.sock == "tcp":
+            return socket.AF_INET, ("127.0.0.1", 37373)
+        # the path of gocode, from os.TempDir() and $USER
+        return socket.AF_UNIX, os.path.join(
+            env.get("TMPDIR") or "/tmp", "gocode-daemon." + (env.get("USER") or "all")
+        )
+
+    def connect(self, env, wait=0.0):
+        """Connect to the daemon, trying again for wait seconds."""
+        family, address = self.get_address(env)
+        deadline = time.monotonic() + wait
+        while True:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(address)
+                self.connection = go_gob.RPCClient(sock)
+                return
+            except OSError:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise
+            time.sleep(0.05)
+
+    def disconnect(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def autocomplete(self, request):
+        """Run request on the daemon, or spawn gocode for it."""
+        with self.lock:
+            if request.cancelled:
+                return request
+            if self.rpc:
+                for retry in (False, True):
+                    if retry:
+                        self.disconnect()
+                        if not self.start(request.args[0], request.env):
+                            break
+                    if self.call(request, wait=1.0 if retry else 0.0):
+                        return request
+                    if not self.rpc:
+                        break
+        request.run()
+        return request
+
+    def call(self, request, wait=0.0):
+        try:
+            if self.connection is None:
+                self.connect(request.env, wait)
+            with profiler.stage("gocode.rpc"):
+                reply = self.connection.call(
+                    "Server.AutoComplete", autocomplete_request, self.pack(request)
+                )
+        except go_gob.RPCError as e:
+            if str(e).startswith("rpc: can't find"):
+                # not the RPC of mdempsky/gocode
+                self.rpc = False
+                return False
+            # the daemon works, gocode would fail on this request as well
+            request.stderr_data = str(e).encode("utf-8")
+            request.decoder.set_result(0, [])
+            request.returncode = 1
+            return True
+        except (OSError, EOFError, go_gob.GobError):
+            self.disconnect()
+            return False
+
+        request.decoder.set_result(
+            reply.get("Len", 0),
+            [
+                (x.get("Name", ""), x.get("Type", ""), x.get("Class", ""))
+                for x in reply.get("Candidates", [])
+            ],
+        )
+        request.returncode = 0
+        return True
+
+    def pack(self, request):
+        # [gocode, -f=json, flags..., autocomplete, bufname, offset]
+        flags = request.args[1:-3]
+        return {
+            "Filename": os.path.abspath(request.args[-2]),
+            "Data": request.data,
+            "Cursor": int(request.args[-1]),
+            "Context": self.get_context(request.env),
+            "Source": "-source" in flags,
+            "Builtin": "-builtin" in flags,
+            "UnimportedPackages": "-unimported-packages" in flags,
+            "FallbackToSource": "-fallback-to-source" in flags,
+        }
+
+    def get_context(self, env):
+        """The go/build.Context of the gocode client run with env."""
+        from stdlib import find_goroot, get_go_version
+
+        goroot = env.get("GOROOT") or find_goroot()
+        tags = self.release_tags.get(goroot)
+        if tags is None:
+            m = re.match(r"go1\.(\d+)", get_go_version(goroot))
+            tags = self.release_tags[goroot] = [
+                "go1.%d" % i for i in range(1, int(m.group(1)) + 1 if m else 1)
+            ]
+        goos = env.get("GOOS") or platform.system().lower()
+        goarch = env.get("GOARCH") or default_goarch()
+        return {
+            "GOARCH": goarch,
+            "GOOS": goos,
+            "GOROOT": goroot,
+            "GOPATH": env.get("GOPATH") or os.path.join(os.path.expanduser("~"), "go"),
+            "CgoEnabled": env.get("CGO_ENABLED", "1") == "1",
+            "Compiler": "gc",
+            "ReleaseTags": tags,
+        }
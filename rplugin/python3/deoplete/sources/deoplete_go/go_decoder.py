@@ -0,0 +1,135 @@
+import codecs
+import json
+import re
+
+import go_jsonbackend
+
+# fields of a decoded candidate tuple
+NAME, TYPE, CLASS = 0, 1, 2
+
+
+class StreamDecoder(object):
+    """Decoder of the gocode -f=json output.
+
+    gocode prints [<partial length>, [{"class": ..., "name": ..., "type":
+    ...}, ...]] in one go. Chunks of stdout are fed as they arrive, and each
+    candidate object is converted to a (name, type, class) tuple.
+
+    With a limit, the candidate objects are decoded one at a time as soon as
+    they are complete, and decoding stops once limit candidates are read, so
+    gocode can be killed early. Without one, the chunks are joined and
+    decoded at once by the go_jsonbackend module when the output has ended,
+    which is several times faster than the object loop.
+    """
+
+    header = re.compile(r"\s*\[\s*(?:\]|(\d+)\s*,\s*\[)")
+    separator = re.compile(r"[\s,]*")
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.text = ""
+        self.pos = 0
+        self.length = None
+        self.candidates = []
+        self.done = False
+        self.truncated = False
+        self.error = None
+        self.utf8 = codecs.getincrementaldecoder("utf-8")("replace")
+        self.raw_decode = json.JSONDecoder().raw_decode
+        self.chunks = [] if limit == 0 else None
+
+    def feed(self, data, final=False):
+        if self.done:
+            return
+        if self.chunks is not None:
+            self.chunks.append(data)
+            if final:
+                self.load(b"".join(self.chunks))
+            return
+        self.text = self.text[self.pos :] + self.utf8.decode(data, final)
+        self.pos = 0
+
+        try:
+            self.parse()
+        except (KeyError, TypeError) as e:
+            self.fail(e)
+        except ValueError as e:
+            # an incomplete value, unless the output has ended
+            if final:
+                self.fail(e)
+
+    def close(self):
+        self.feed(b"", final=True)
+
+    def load(self, data):
+        self.text = data.decode("utf-8", "replace")
+        self.done = True
+        try:
+            result = go_jsonbackend.loads(self.text)
+            if not isinstance(result, list):
+                raise TypeError("not a gocode json result")
+            if result:
+                self.candidates = [
+                    (x["name"], x.get("type", ""), x["class"]) for x in result[1]
+                ]
+            self.length = int(result[0]) if result else 0
+        except (IndexError, KeyError, TypeError, ValueError) as e:
+            self.fail(e)
+
+    def set_result(self, length, candidates):
+        """Take the (name, type, class) candidates of another transport."""
+        if self.limit and len(candidates) > self.limit:
+            candidates = candidates[: self.limit]
+            self.truncated = True
+        self.length, self.candidates = length, candidates
+        self.done = True
+
+    def parse(self):
+        text = self.text
+        if self.length is None:
+            m = self.header.match(text)
+            if not m:
+                if not text.lstrip().startswith("[") and text.strip():
+                    raise TypeError("not a gocode json result")
+                raise ValueError("incomplete header")
+            self.pos = m.end()
+            if m.group(1) is None:
+                # "[]", no candidates
+                self.length = 0
+                self.done = True
+                return
+            self.length = int(m.group(1))
+
+        append = self.candidates.append
+        while True:
+            pos = self.separator.match(text, self.pos).end()
+            if pos == len(text):
+                self.pos = pos
+                raise ValueError("incomplete candidates")
+            if text[pos] == "]":
+                self.pos = pos + 1
+                self.done = True
+                return
+
+            obj, self.pos = self.raw_decode(text, pos)
+            append((obj["name"], obj.get("type", ""), obj["class"]))
+            if self.limit and len(self.candidates) >= self.limit:
+                self.done = self.truncated = True
+                return
+
+    def fail(self, e):
+        self.error = "{}: {}".format(e, self.text[self.pos : self.pos + 200])
+        self.done = True
+
+    @property
+    def result(self):
+        if self.error is not None or self.length is None:
+            return []
+        return [self.length, self.candidates]
+
+
+def decode(data, limit=0):
+    """Decode a complete gocode json result, see StreamDecoder."""
+    decoder = StreamDecoder(limit)
+    decoder.feed(data, final=True)
+    return decoder
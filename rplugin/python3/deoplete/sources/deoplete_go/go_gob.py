@@ -0,0 +1,332 @@
+import struct
+
+# predefined type ids of encoding/gob
+BOOL, INT, UINT, FLOAT, BYTES, STRING, COMPLEX = 1, 2, 3, 4, 5, 6, 7
+WIRE_TYPE = 16
+
+type_names = {
+    BOOL: "bool",
+    INT: "int",
+    UINT: "uint",
+    FLOAT: "float64",
+    BYTES: "[]byte",
+    STRING: "string",
+    COMPLEX: "complex128",
+}
+
+# the types describing the types sent by the peer, see wireType in
+# encoding/gob/type.go. GobEncoder types are not supported.
+builtin_types = {
+    16: ("struct", [("ArrayT", 17), ("SliceT", 19), ("StructT", 20), ("MapT", 23)]),
+    17: ("struct", [("CommonType", 18), ("Elem", INT), ("Len", INT)]),
+    18: ("struct", [("Name", STRING), ("Id", INT)]),
+    19: ("struct", [("CommonType", 18), ("Elem", INT)]),
+    20: ("struct", [("CommonType", 18), ("Field", 22)]),
+    21: ("struct", [("Name", STRING), ("Id", INT)]),
+    22: ("slice", 21),
+    23: ("struct", [("CommonType", 18), ("Key", INT), ("Elem", INT)]),
+}
+
+# the ids of the types sent by Encoder start after the predefined ones
+first_user_id = 65
+
+
+class GobError(Exception):
+    pass
+
+
+class RPCError(Exception):
+    """An error returned by the net/rpc server."""
+
+
+class Struct(object):
+    """A Go struct type sent by Encoder, fields are (name, type) pairs.
+
+    A type is a predefined type id, a Struct or a Slice.
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+
+class Slice(object):
+    def __init__(self, elem):
+        self.elem = elem
+        self.name = "[]" + type_names.get(elem, getattr(elem, "name", ""))
+
+
+def encode_uint(out, v):
+    if v < 128:
+        out.append(v)
+        return
+    data = v.to_bytes((v.bit_length() + 7) // 8, "big")
+    out.append(256 - len(data))
+    out += data
+
+
+def encode_int(out, v):
+    encode_uint(out, (~v << 1) | 1 if v < 0 else v << 1)
+
+
+def encode_bytes(out, data):
+    encode_uint(out, len(data))
+    out += data
+
+
+class Encoder(object):
+    """encoding/gob encoder of one stream.
+
+    The definition of each Struct and Slice is sent before its first value,
+    once per stream.
+    """
+
+    def __init__(self):
+        self.ids = dict()
+
+    def encode(self, gotype, value):
+        """Return the messages sending value of gotype."""
+        out = bytearray()
+        type_id = self.type_id(gotype, out)
+        payload = bytearray()
+        encode_int(payload, type_id)
+        if not isinstance(gotype, Struct):
+            # a value other than a struct is sent as field 0
+            encode_uint(payload, 0)
+        self.value(payload, gotype, value)
+        encode_uint(out, len(payload))
+        out += payload
+        return bytes(out)
+
+    def type_id(self, gotype, out):
+        if isinstance(gotype, int):
+            return gotype
+        type_id = self.ids.get(gotype)
+        if type_id is not None:
+            return type_id
+
+        wire = bytearray()
+        if isinstance(gotype, Struct):
+            fields = [(name, self.type_id(t, out)) for name, t in gotype.fields]
+            type_id = self.ids[gotype] = first_user_id + len(self.ids)
+            # wireType.StructT, structType.CommonType
+            encode_uint(wire, 3)
+            encode_uint(wire, 1)
+            self.common_type(wire, gotype.name, type_id)
+            if fields:
+                # structType.Field
+                encode_uint(wire, 1)
+                encode_uint(wire, len(fields))
+                for name, field_id in fields:
+                    self.common_type(wire, name, field_id)
+            encode_uint(wire, 0)
+        else:
+            elem = self.type_id(gotype.elem, out)
+            type_id = self.ids[gotype] = first_user_id + len(self.ids)
+            # wireType.SliceT, sliceType.CommonType, sliceType.Elem
+            encode_uint(wire, 2)
+            encode_uint(wire, 1)
+            self.common_type(wire, gotype.name, type_id)
+            encode_uint(wire, 1)
+            encode_int(wire, elem)
+            encode_uint(wire, 0)
+        encode_uint(wire, 0)
+
+        payload = bytearray()
+        encode_int(payload, -type_id)
+        payload += wire
+        encode_uint(out, len(payload))
+        out += payload
+        return type_id
+
+    def common_type(self, out, name, type_id):
+        # CommonType and fieldType are both {Name string; Id typeId}
+        if name:
+            encode_uint(out, 1)
+            encode_bytes(out, name.encode("utf-8"))
+            encode_uint(out, 1)
+        else:
+            encode_uint(out, 2)
+        encode_int(out, type_id)
+        encode_uint(out, 0)
+
+    def value(self, out, gotype, value):
+        if gotype == BOOL:
+            encode_uint(out, 1 if value else 0)
+        elif gotype == INT:
+            encode_int(out, value)
+        elif gotype == UINT:
+            encode_uint(out, value)
+        elif gotype == BYTES:
+            encode_bytes(out, value)
+        elif gotype == STRING:
+            encode_bytes(out, value.encode("utf-8"))
+        elif isinstance(gotype, Struct):
+            last = -1
+            for i, (name, t) in enumerate(gotype.fields):
+                v = value.get(name)
+                # zero values are not sent
+                if not v:
+                    continue
+                encode_uint(out, i - last)
+                self.value(out, t, v)
+                last = i
+            encode_uint(out, 0)
+        elif isinstance(gotype, Slice):
+            encode_uint(out, len(value))
+            for v in value:
+                self.value(out, gotype.elem, v)
+        else:
+            raise GobError("cannot encode type {}".format(gotype))
+
+
+class Reader(object):
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def take(self, n):
+        if self.pos + n > len(self.data):
+            raise GobError("truncated message")
+        self.pos += n
+        return self.data[self.pos - n : self.pos]
+
+    def uint(self):
+        b = self.take(1)[0]
+        if b < 128:
+            return b
+        return int.from_bytes(self.take(256 - b), "big")
+
+    def int(self):
+        u = self.uint()
+        return ~(u >> 1) if u & 1 else u >> 1
+
+    def float(self):
+        return struct.unpack("<d", struct.pack(">Q", self.uint()))[0]
+
+    def bytes(self):
+        return bytes(self.take(self.uint()))
+
+
+class Decoder(object):
+    """encoding/gob decoder of one stream.
+
+    Structs are decoded to dicts of the fields sent (zero values are not),
+    slices and arrays to lists and maps to dicts.
+    """
+
+    def __init__(self):
+        self.types = dict(builtin_types)
+
+    def decode(self, read):
+        """Read the messages of one value with read(n), and return it."""
+        while True:
+            reader = Reader(read_message(read))
+            type_id = reader.int()
+            if type_id < 0:
+                self.types[-type_id] = self.wire_type(self.value(reader, WIRE_TYPE))
+                continue
+            if self.types.get(type_id, ("",))[0] != "struct":
+                if reader.uint() != 0:
+                    raise GobError("bad singleton")
+            return self.value(reader, type_id)
+
+    def wire_type(self, wire):
+        if "StructT" in wire:
+            fields = wire["StructT"].get("Field", [])
+            return ("struct", [(x.get("Name", ""), x.get("Id", 0)) for x in fields])
+        if "SliceT" in wire:
+            return ("slice", wire["SliceT"].get("Elem", 0))
+        if "ArrayT" in wire:
+            return ("slice", wire["ArrayT"].get("Elem", 0))
+        if "MapT" in wire:
+            return ("map", wire["MapT"].get("Key", 0), wire["MapT"].get("Elem", 0))
+        raise GobError("unsupported type {}".format(wire))
+
+    def value(self, reader, type_id):
+        if type_id == BOOL:
+            return reader.uint() != 0
+        if type_id == INT:
+            return reader.int()
+        if type_id == UINT:
+            return reader.uint()
+        if type_id == FLOAT:
+            return reader.float()
+        if type_id == BYTES:
+            return reader.bytes()
+        if type_id == STRING:
+            return reader.bytes().decode("utf-8", "replace")
+        if type_id == COMPLEX:
+            return complex(reader.float(), reader.float())
+
+        gotype = self.types.get(type_id)
+        if gotype is None:
+            raise GobError("unknown type id {}".format(type_id))
+        if gotype[0] == "struct":
+            fields = gotype[1]
+            result = dict()
+            field = -1
+            while True:
+                delta = reader.uint()
+                if delta == 0:
+                    return result
+                field += delta
+                if field >= len(fields):
+                    raise GobError("bad field number {}".format(field))
+                name, field_id = fields[field]
+                result[name] = self.value(reader, field_id)
+        if gotype[0] == "slice":
+            return [self.value(reader, gotype[1]) for _ in range(reader.uint())]
+        result = dict()
+        for _ in range(reader.uint()):
+            key = self.value(reader, gotype[1])
+            result[key] = self.value(reader, gotype[2])
+        return result
+
+
+def read_message(read):
+    b = read_exactly(read, 1)[0]
+    if b < 128:
+        length = b
+    else:
+        length = int.from_bytes(read_exactly(read, 256 - b), "big")
+    return read_exactly(read, length)
+
+
+def read_exactly(read, n):
+    data = read(n)
+    if len(data) != n:
+        raise EOFError("connection closed")
+    return data
+
+
+class RPCClient(object):
+    """Client of a Go net/rpc server with the gob codec, one call at a time."""
+
+    request_type = Struct("Request", [("ServiceMethod", STRING), ("Seq", UINT)])
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.file = sock.makefile("rb")
+        self.encoder = Encoder()
+        self.decoder = Decoder()
+        self.seq = 0
+
+    def call(self, method, args_type, args):
+        self.seq += 1
+        header = {"ServiceMethod": method, "Seq": self.seq}
+        self.sock.sendall(
+            self.encoder.encode(self.request_type, header)
+            + self.encoder.encode(args_type, args)
+        )
+        response = self.decoder.decode(self.file.read)
+        reply = self.decoder.decode(self.file.read)
+        if response.get("Seq", 0) != self.seq:
+            raise GobError("unexpected response {}".format(response))
+        if response.get("Error"):
+            raise RPCError(response["Error"])
+        return reply
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
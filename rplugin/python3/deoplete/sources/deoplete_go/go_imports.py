@@ -0,0 +1,157 @@
+import re
+
+spec_pattern = re.compile(r'(?:([^\W\d]\w*|\.)\s+)?(?:"([^"]*)"|`([^`]*)`)')
+
+
+def default_name(path):
+    """Guess the package name of an import path without an alias.
+
+    math/rand/v2 is rand, gopkg.in/yaml.v2 is yaml, and
+    github.com/mattn/go-sqlite3 is sqlite3.
+    """
+    parts = path.split("/")
+    name = parts[-1]
+    if len(parts) > 1 and re.match(r"v\d+$", name):
+        name = parts[-2]
+    name = re.sub(r"\.v\d+$", "", name)
+    if name.startswith("go-"):
+        name = name[3:]
+    elif name.endswith("-go"):
+        name = name[:-3]
+    return name.replace("-", "_").replace(".", "_")
+
+
+def strip_comments(line, in_comment):
+    """Return the code of line outside comments, and whether a /* is open."""
+    code = []
+    i = 0
+    while i < len(line):
+        if in_comment:
+            j = line.find("*/", i)
+            if j < 0:
+                return "".join(code), True
+            i = j + 2
+            in_comment = False
+            continue
+        block = line.find("/*", i)
+        comment = line.find("//", i)
+        if comment >= 0 and (block < 0 or comment < block):
+            code.append(line[i:comment])
+            break
+        if block < 0:
+            code.append(line[i:])
+            break
+        code.append(line[i:block])
+        i = block + 2
+        in_comment = True
+    return "".join(code), in_comment
+
+
+def ends_in_code(text):
+    """Return whether the end of text is code, not in a string or comment.
+
+    text is a line up to the cursor; a /* or raw string opened on an
+    earlier line is not seen.
+    """
+    quote = None
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if quote is None:
+            if text.startswith("//", i):
+                return False
+            if text.startswith("/*", i):
+                end = text.find("*/", i + 2)
+                if end < 0:
+                    return False
+                i = end + 2
+                continue
+            if c in "\"'`":
+                quote = c
+        elif c == "\\" and quote != "`":
+            i += 1
+        elif c == quote:
+            quote = None
+        i += 1
+    return quote is None
+
+
+def parse(lines):
+    """Return the (name, path) import specs of lines, and the line after them.
+
+    name is the alias, "." or "_", or "" for none. Parsing stops at the first
+    declaration that is not an import. Declarations and specs may share a
+    line, separated by semicolons: import "a"; import "b" are two unaliased
+    specs.
+    """
+    imports = []
+    in_comment = False
+    in_group = False
+    for i, line in enumerate(lines):
+        code, in_comment = strip_comments(line, in_comment)
+        # import paths contain no semicolons
+        for code in code.split(";"):
+            code = code.strip()
+            if not code:
+                continue
+            if not in_group:
+                if code.startswith("package "):
+                    continue
+                if not code.startswith("import"):
+                    return imports, i
+                code = code[len("import") :].lstrip()
+                if code.startswith("("):
+                    in_group = True
+                    code = code[1:]
+            if in_group:
+                end = code.find(")")
+                if end >= 0:
+                    in_group = False
+                    code = code[:end]
+            for name, path, raw in spec_pattern.findall(code):
+                imports.append((name, path or raw))
+    return imports, len(lines)
+
+
+class ImportIndex(object):
+    """The imports of a buffer, for package name to import path lookups.
+
+    update() parses the import declarations once per b:changedtick, and
+    skips parsing when the lines up to the end of the imports are unchanged,
+    e.g. while typing in a function body. A buffer without a declaration
+    after its imports is parsed again on every change.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.head = None
+        self.imports = []
+        self.names = dict()
+
+    def update(self, snapshot):
+        key = (snapshot.bufnr, snapshot.changedtick)
+        if key == self.key and key[1] is not None:
+            return self
+        self.key = key
+
+        lines = snapshot.lines
+        if self.head is not None and lines[: len(self.head)] == self.head:
+            return self
+
+        self.imports, end = parse(lines)
+        # imports may be appended after a head ending the buffer
+        self.head = lines[: end + 1] if end < len(lines) else None
+        self.names = dict()
+        for name, path in self.imports:
+            if name in (".", "_"):
+                continue
+            self.names[name or default_name(path)] = path
+        return self
+
+    def lookup(self, name):
+        """Return the import path of the package name refers to, or None."""
+        return self.names.get(name)
+
+    @property
+    def paths(self):
+        return [path for _, path in self.imports]
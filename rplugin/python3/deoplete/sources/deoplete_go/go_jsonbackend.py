@@ -0,0 +1,96 @@
+import importlib
+import threading
+
+import profiler
+
+# the json modules, in the order of preference without a calibration sample
+backends = ("orjson", "rapidjson", "simplejson", "ujson", "json")
+
+requested = "auto"
+sample = None
+rounds = 3
+name = None
+decode = None
+timings = dict()
+lock = threading.Lock()
+
+
+def configure(backend="auto", sample_path=None, calibration_rounds=3):
+    """Use the json module backend, or "auto" for the fastest on sample_path.
+
+    Nothing is imported here: the module is chosen by the first loads().
+    """
+    global requested, sample, rounds, name, decode
+    with lock:
+        requested = backend or "auto"
+        sample = sample_path
+        rounds = calibration_rounds
+        name = decode = None
+        timings.clear()
+
+
+def loads(text):
+    if decode is None:
+        select()
+    return decode(text)
+
+
+def select():
+    """Import the configured json module, and return its name.
+
+    With "auto", or when the configured module is missing, each available
+    module decodes the sample rounds times and the fastest is kept.
+    """
+    global name, decode
+    with lock:
+        if decode is not None:
+            return name
+        found = find(requested) if requested in backends else None
+        if found is not None:
+            chosen = (requested, found)
+        else:
+            chosen = calibrate([(x, find(x)) for x in backends])
+        name, decode = chosen
+        profiler.info["json_backend"] = {
+            "name": name,
+            "requested": requested,
+            "calibration_ms": {k: v * 1000 for k, v in timings.items()},
+        }
+        return name
+
+
+def find(backend):
+    """Return the loads function of the json module backend, or None."""
+    try:
+        return importlib.import_module(backend).loads
+    except ImportError:
+        return None
+
+
+def calibrate(candidates):
+    available = [x for x in candidates if x[1] is not None]
+    text = None
+    if sample:
+        try:
+            with open(sample, encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            pass
+    if text is None or len(available) == 1:
+        return available[0]
+
+    best = None
+    for backend, func in available:
+        elapsed = None
+        try:
+            for _ in range(rounds):
+                start = profiler.clock()
+                func(text)
+                t = profiler.clock() - start
+                elapsed = t if elapsed is None else min(elapsed, t)
+        except ValueError:
+            continue
+        timings[backend] = elapsed
+        if best is None or elapsed < timings[best[0]]:
+            best = (backend, func)
+    return best or available[-1]
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from go_cache import mtime
+
+
+class PkgConfig(object):
+    """Memoized pkg-config lookups of the '#cgo pkg-config:' packages.
+
+    The flags of a package are cached per PKG_CONFIG_PATH together with the
+    mtime of its .pc file, so pkg-config only runs again when the file
+    changed. Packages not cached yet are resolved concurrently, and a package
+    pkg-config does not know is retried after retry_interval seconds.
+    """
+
+    def __init__(self, max_workers=4, retry_interval=30.0):
+        self.max_workers = max_workers
+        self.retry_interval = retry_interval
+        self.binary = None
+        self.entries = dict()
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def find_binary(self):
+        if self.binary is None:
+            # the location is looked up once per session
+            from cgo import cgo
+
+            self.binary = cgo.find_binary_path("pkg-config")
+        return self.binary
+
+    def flags(self, packages):
+        """Return the --cflags --libs flags of packages, in order."""
+        if not packages or not self.find_binary():
+            return []
+
+        search_path = os.environ.get("PKG_CONFIG_PATH", "")
+        keys = [(x, search_path) for x in packages]
+        missing = [x for x in set(keys) if not self.is_fresh(x)]
+        if len(missing) == 1:
+            self.resolve(missing[0])
+        elif missing:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            list(self.executor.map(self.resolve, missing))
+
+        out = []
+        with self.lock:
+            for key in keys:
+                out += self.entries[key][2]
+        return out
+
+    def is_fresh(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return False
+        pcfile, stamp, _ = entry
+        if pcfile is None:
+            # pkg-config failed, stamp is the time of the failure
+            return time.monotonic() - stamp < self.retry_interval
+        return mtime(pcfile) == stamp
+
+    def resolve(self, key):
+        package, search_path = key
+        try:
+            flags = self.run("--cflags", "--libs", package).split()
+            pcfile = os.path.join(
+                self.run("--variable=pcfiledir", package).strip(), package + ".pc"
+            )
+            entry = (pcfile, mtime(pcfile), flags)
+        except (OSError, subprocess.CalledProcessError):
+            entry = (None, time.monotonic(), [])
+        with self.lock:
+            self.entries[key] = entry
+
+    def run(self, *args):
+        return subprocess.check_output(
+            (self.binary,) + args, stderr=subprocess.DEVNULL, universal_newlines=True
+        )
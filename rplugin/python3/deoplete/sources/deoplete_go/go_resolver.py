@@ -0,0 +1,112 @@
+import os
+import platform
+import re
+import subprocess
+import time
+
+
+class GocodeResolver(object):
+    """Locate the gocode binary, and learn its flags, once per session.
+
+    The resolved path is kept with the PATH it was found in and the
+    mtime/inode of the binary. It is only searched again when one of them
+    changes, which also detects the flavour and the supported flags again
+    from the help output. A failed search is retried after retry_interval
+    seconds, and reported once per attempt through on_error.
+    """
+
+    # gocode forks, detected by detect_flavour()
+    flavours = ("nsf", "mdempsky", "stamblerre")
+
+    help_flag = re.compile(r"^\s+-([\w-]+)", re.MULTILINE)
+
+    def __init__(self, binary="", on_error=None, retry_interval=30.0):
+        self.binary = binary
+        self.on_error = on_error
+        self.retry_interval = retry_interval
+        self.name = "gocode"
+        if platform.system().lower() == "windows":
+            self.name = "gocode.exe"
+        self.path = None
+        self.stamp = None
+        self.search_path = None
+        self.failed = None
+        self.flavour = None
+        # None when the help output could not be read, allowing any flag
+        self.flags = None
+
+    def resolve(self):
+        """Return the path of gocode, or None."""
+        search_path = os.environ.get("PATH", "")
+        if self.path is not None and search_path == self.search_path:
+            if self.get_stamp(self.path) == self.stamp:
+                return self.path
+        elif self.path is None and self.failed is not None:
+            if time.monotonic() - self.failed < self.retry_interval:
+                return None
+
+        path = self.find()
+        if path is None:
+            self.path = None
+            self.failed = time.monotonic()
+            if self.on_error is not None:
+                self.on_error(self.name + " binary not found")
+            return None
+
+        stamp = self.get_stamp(path)
+        if path != self.path or stamp != self.stamp:
+            self.flavour, self.flags = self.detect_flavour(path)
+        self.path, self.stamp, self.search_path = path, stamp, search_path
+        self.failed = None
+        return path
+
+    def supports(self, flag):
+        """Whether gocode accepts flag, e.g. "-source" or "-sock=unix"."""
+        if self.flags is None:
+            return True
+        return flag.lstrip("-").split("=", 1)[0] in self.flags
+
+    def find(self):
+        if self.binary and is_exec(self.binary):
+            return self.binary
+        for p in os.environ.get("PATH", "").split(os.pathsep):
+            binary = os.path.join(p.strip('"'), self.name)
+            if is_exec(binary):
+                return binary
+        return None
+
+    def get_stamp(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def detect_flavour(self, path):
+        """Return the flavour and the flag names of the gocode at path."""
+        try:
+            out = subprocess.run(
+                [path, "-h"],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=2,
+            ).stdout.decode(errors="replace")
+        except (OSError, subprocess.SubprocessError):
+            return None, None
+
+        flags = frozenset(self.help_flag.findall(out))
+        if not flags:
+            return None, None
+        if "source" not in flags:
+            # nsf/gocode is configured with 'gocode set' instead
+            flavour = "nsf"
+        elif "gomod" in os.path.basename(path) or "module" in out.lower():
+            flavour = "stamblerre"
+        else:
+            flavour = "mdempsky"
+        return flavour, flags
+
+
+def is_exec(path):
+    return os.path.isfile(path) and os.access(path, os.X_OK)
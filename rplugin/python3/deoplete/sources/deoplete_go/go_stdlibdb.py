@@ -0,0 +1,118 @@
+import mmap
+import struct
+
+# <GOOS>_<GOARCH>.db, all integers little-endian uint32:
+#
+#   header   magic, package count, records offset, strings offset, string count
+#   index    (path string, first record, record count) per package, by path
+#   records  (name string, type string, class string) per member
+#   strings  string count + 1 byte offsets into the utf-8 blob, then the blob
+#
+# Every distinct string is stored once and referenced by its number.
+MAGIC = b"DGOSTD\x00\x01"
+HEADER = struct.Struct("<8sIIII")
+ENTRY = struct.Struct("<III")
+RECORD = struct.Struct("<III")
+OFFSETS = struct.Struct("<II")
+
+
+def write(path, packages):
+    """Write packages, {import path: [(name, type, class), ...]}, to path."""
+    ids = dict()
+    strings = []
+
+    def intern(s):
+        i = ids.get(s)
+        if i is None:
+            i = ids[s] = len(strings)
+            strings.append(s.encode("utf-8"))
+        return i
+
+    index = bytearray()
+    records = bytearray()
+    first = 0
+    for package in sorted(packages):
+        rows = packages[package]
+        index += ENTRY.pack(intern(package), first, len(rows))
+        for name, _type, _class in rows:
+            records += RECORD.pack(intern(name), intern(_type), intern(_class))
+        first += len(rows)
+
+    offsets = bytearray()
+    blob = bytearray()
+    for s in strings:
+        offsets += struct.pack("<I", len(blob))
+        blob += s
+    offsets += struct.pack("<I", len(blob))
+
+    records_start = HEADER.size + len(index)
+    strings_start = records_start + len(records)
+    with open(path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC, len(packages), records_start, strings_start, len(strings)
+            )
+        )
+        f.write(index)
+        f.write(records)
+        f.write(offsets)
+        f.write(blob)
+
+
+class StdlibDatabase(object):
+    """Read-only view of a stdlib database written by write().
+
+    The file is mapped, not read: opening it decodes the package index only,
+    and get() decodes the members of one package. Strings are decoded once
+    and shared by every package referencing them.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, count, self.records_start, strings_start, nstrings = (
+                HEADER.unpack_from(self.data, 0)
+            )
+            if magic != MAGIC:
+                raise ValueError("{}: not a stdlib database".format(path))
+            self.blob_start = strings_start + (nstrings + 1) * 4
+            self.strings_start = strings_start
+            self.strings = dict()
+            self.index = dict()
+            for path_id, first, length in ENTRY.iter_unpack(
+                self.data[HEADER.size : HEADER.size + count * ENTRY.size]
+            ):
+                self.index[self.string(path_id)] = (first, length)
+        except (struct.error, ValueError):
+            self.data.close()
+            raise
+
+    def string(self, i):
+        s = self.strings.get(i)
+        if s is None:
+            start, end = OFFSETS.unpack_from(self.data, self.strings_start + i * 4)
+            s = self.strings[i] = self.data[
+                self.blob_start + start : self.blob_start + end
+            ].decode("utf-8")
+        return s
+
+    def __contains__(self, package):
+        return package in self.index
+
+    def get(self, package):
+        entry = self.index.get(package)
+        if entry is None:
+            return None
+        first, length = entry
+        start = self.records_start + first * RECORD.size
+        string = self.string
+        return [
+            (string(name), string(_type), string(_class))
+            for name, _type, _class in RECORD.iter_unpack(
+                self.data[start : start + length * RECORD.size]
+            )
+        ]
+
+    def close(self):
+        self.data.close()
@@ -1,23 +1,14 @@
+import atexit
 import functools
-import queue
+import json
+import math
+import os
+import threading
+import time
 
 try:
-    import statistics
-
-    stdev = statistics.stdev
-    mean = statistics.mean
-except ImportError:
-    stdev = None
-
-    def mean(l):
-        return sum(l) / len(l)
-
-
-try:
-    import time
-
     clock = time.perf_counter
-except Exception:
+except AttributeError:
     import timeit
 
     clock = timeit.default_timer
@@ -31,28 +22,154 @@ class tfloat(float):
         return "\x1b[%dm%f\x1b[mms" % (self.color, n)
 
 
+class Histogram(object):
+    """Latency histogram of one stage with power-of-two microsecond buckets."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * 32
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.squares += seconds * seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        us = int(seconds * 1e6)
+        self.buckets[min(us.bit_length(), len(self.buckets) - 1)] += 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def stdev(self):
+        if self.count < 2:
+            return 0.0
+        variance = (self.squares - self.total * self.total / self.count) / (self.count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile, in seconds."""
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.mean * 1000,
+            "stdev_ms": self.stdev * 1000,
+            "min_ms": (self.min or 0.0) * 1000,
+            "max_ms": self.max * 1000,
+            "p50_ms": self.percentile(50) * 1000,
+            "p95_ms": self.percentile(95) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            # bucket i counts samples below 2**i us
+            "buckets_us": {str(1 << i): n for i, n in enumerate(self.buckets) if n},
+        }
+
+
+# Instrumentation is off unless g:deoplete#sources#go#profile is set
+enabled = False
+stats = dict()
+info = dict()
+lock = threading.Lock()
+dump_path = ""
+dump_interval = 5.0
+dumper = None
+
+
+def configure(enable, path="", interval=5.0):
+    """Enable the instrumentation, and dump it to path every interval seconds."""
+    global enabled, dump_path, dump_interval, dumper
+    enabled = bool(enable)
+    dump_path = path
+    dump_interval = interval
+    if enabled and dump_path and dumper is None:
+        dumper = threading.Thread(target=dump_periodically, daemon=True)
+        dumper.start()
+
+
+def record(name, seconds):
+    with lock:
+        histogram = stats.get(name)
+        if histogram is None:
+            histogram = stats[name] = Histogram()
+        histogram.add(seconds)
+
+
+class stage(object):
+    """Context manager timing a block as stage name."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock() if enabled else None
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            record(self.name, clock() - self.start)
+        return False
+
+
+def timer(name):
+    """Decorator timing every call of a function as stage name."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, clock() - start)
+
+        return wrapper
+
+    return decorator
+
+
 def profile(func):
+    """Decorator for Source methods.
+
+    Records the stage like timer(), and logs each call with the running
+    mean and standard deviation when deoplete debug logging is enabled.
+    """
     name = func.__name__
-    samples = queue.deque(maxlen=5)
 
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
-        if not self.debug_enabled:
+        if not enabled and not self.debug_enabled:
             return func(self, *args, **kwargs)
         start = clock()
         ret = func(self, *args, **kwargs)
         n = tfloat(clock() - start)
+        if not self.debug_enabled:
+            record(name, n)
+            return ret
 
-        if len(samples) < 2:
+        histogram = stats.get(name)
+        if histogram is None or histogram.count < 2:
             m = 0
             d = 0
             n.color = 36
         else:
-            m = mean(samples)
-            if stdev:
-                d = tfloat(stdev(samples))
-            else:
-                d = 0
+            m = tfloat(histogram.mean)
+            d = tfloat(histogram.stdev)
 
             if n <= m + d:
                 n.color = 32
@@ -60,8 +177,54 @@ def profile(func):
                 n.color = 31
             else:
                 n.color = 33
-        samples.append(n)
+        record(name, n)
         self.info("\x1b[34m%s\x1b[m t = %s, \u00b5 = %s, \u03c3 = %s)", name, n, m, d)
         return ret
 
     return wrapper
+
+
+def snapshot():
+    with lock:
+        return {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "info": dict(info),
+            "stages": {k: v.to_dict() for k, v in sorted(stats.items())},
+        }
+
+
+def dump(path=None):
+    path = path or dump_path
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot(), f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def dump_periodically():
+    count = 0
+    while True:
+        time.sleep(dump_interval)
+        if not enabled or not dump_path:
+            continue
+        with lock:
+            total = sum(x.count for x in stats.values())
+        if total != count:
+            count = total
+            try:
+                dump()
+            except OSError:
+                pass
+
+
+@atexit.register
+def dump_at_exit():
+    if enabled and dump_path:
+        try:
+            dump()
+        except OSError:
+            pass
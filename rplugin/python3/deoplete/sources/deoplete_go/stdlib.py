@@ -1,3 +1,8 @@
+import json
+import os
+import re
+
+
 class stdlib(object):
     packages = dict(
         {
@@ -137,3 +142,131 @@ class stdlib(object):
             "zlib": ["compress"],
         }
     )
+
+    # package name -> import paths, see lookup()
+    index = None
+
+    def lookup(name):
+        """Return the import paths of the standard library packages named name.
+
+        The index is built on the first call from the local GOROOT (cached
+        on disk per Go version), or else from the newest bundled
+        data/stdlib-*.txt, or else from stdlib.packages.
+        """
+        if stdlib.index is None:
+            stdlib.index = load_index()
+        return stdlib.index.get(name, ())
+
+
+data_directory = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "..", "data")
+)
+
+
+def package_name(path):
+    # math/rand/v2 is package rand
+    parts = path.split("/")
+    if len(parts) > 1 and re.match(r"v\d+$", parts[-1]):
+        return parts[-2]
+    return parts[-1]
+
+
+def build_index(paths):
+    index = dict()
+    for path in sorted(set(paths)):
+        index.setdefault(package_name(path), []).append(path)
+    return {k: tuple(v) for k, v in index.items()}
+
+
+def find_goroot():
+    if os.environ.get("GOROOT"):
+        return os.environ["GOROOT"]
+    # go finds its GOROOT the same way, from the location of the binary
+    for path in os.environ.get("PATH", "").split(os.pathsep):
+        binary = os.path.join(path.strip('"'), "go")
+        if os.path.isfile(binary) and os.access(binary, os.X_OK):
+            return os.path.dirname(os.path.dirname(os.path.realpath(binary)))
+    return ""
+
+
+def get_go_version(goroot):
+    try:
+        with open(os.path.join(goroot, "VERSION")) as f:
+            return f.readline().strip()
+    except OSError:
+        pass
+    try:
+        # a development tree has no VERSION file
+        return "devel-{}".format(os.stat(os.path.join(goroot, "src")).st_mtime)
+    except OSError:
+        return ""
+
+
+def scan_goroot(goroot):
+    src = os.path.join(goroot, "src")
+    paths = []
+    for root, dirs, files in os.walk(src):
+        dirs[:] = [
+            x
+            for x in dirs
+            if x not in ("internal", "vendor", "testdata", "cmd")
+            and not x.startswith((".", "_"))
+        ]
+        if any(x.endswith(".go") and not x.endswith("_test.go") for x in files):
+            path = os.path.relpath(root, src).replace(os.sep, "/")
+            if path != "." and path != "builtin":
+                paths.append(path)
+    return paths
+
+
+def read_bundled_paths():
+    def version(name):
+        return [int(x) if x.isdigit() else 0 for x in re.split(r"[._-]", name)]
+
+    try:
+        names = [x for x in os.listdir(data_directory) if x.startswith("stdlib-")]
+    except OSError:
+        return []
+    if not names:
+        return []
+    with open(os.path.join(data_directory, max(names, key=version))) as f:
+        return f.read().split()
+
+
+def load_index(goroot=None, cache_directory=None):
+    goroot = find_goroot() if goroot is None else goroot
+    version = get_go_version(goroot) if goroot else ""
+    if version:
+        if cache_directory is None:
+            from go_cache import default_cache_directory
+
+            cache_directory = default_cache_directory()
+        path = os.path.join(cache_directory, "stdlib-{}.json".format(version))
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data["goroot"] == goroot:
+                return {k: tuple(v) for k, v in data["packages"].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index = build_index(scan_goroot(goroot))
+        if index:
+            try:
+                os.makedirs(cache_directory, exist_ok=True)
+                tmp = "{}.{}.tmp".format(path, os.getpid())
+                with open(tmp, "w") as f:
+                    json.dump({"goroot": goroot, "packages": index}, f)
+                os.replace(tmp, path)
+            except OSError:
+                pass
+            return index
+
+    index = build_index(read_bundled_paths())
+    if index:
+        return index
+    return build_index(
+        name if parent == name else parent + "/" + name
+        for name, parents in stdlib.packages.items()
+        for parent in parents
+    )